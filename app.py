@@ -5,24 +5,38 @@ Handles webhooks and coordinates all integrations
 
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 import uvicorn
+import asyncio
+import httpx
 import logging
+import os
+import time
 from typing import Dict, Any
-import json
+import orjson
 from contextlib import asynccontextmanager
 
+try:
+    import uvloop  # noqa: F401
+    UVICORN_LOOP = "uvloop"
+except ImportError:
+    # uvloop is not available on Windows, fall back to the default asyncio loop
+    UVICORN_LOOP = "asyncio"
+
 from src.core.router import MessageRouter
 from src.integrations.whatsapp import WhatsAppIntegration
 # from src.integrations.gmail import GmailIntegration
 from src.integrations.calendar import CalendarIntegration
 from src.core.hitl import HITLManager
+from src.core.middleware import AccessLogMiddleware
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (set LOG_LEVEL=WARNING in production to skip per-message logs)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Global variables for dependency injection
@@ -32,6 +46,17 @@ calendar = None
 hitl_manager = None
 router = None
 
+# Short-lived cache so status pollers don't probe every integration per request
+STATUS_CACHE_TTL = 5  # seconds
+_status_cache = {"ts": 0.0, "value": None}
+
+# Largest webhook body accepted from UltraMsg
+MAX_WEBHOOK_BODY_BYTES = int(os.getenv("MAX_WEBHOOK_BODY_BYTES", str(1024 * 1024)))
+
+# Static liveness payloads, serialized once at import
+_ROOT_BODY = orjson.dumps({"message": "Personal WhatsApp Assistant is running", "status": "healthy"})
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "whatsapp-assistant"})
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager for startup and shutdown"""
@@ -40,16 +65,32 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting Personal WhatsApp Assistant...")
     
+    # Shared HTTP connection pool for outbound API calls
+    app.state.http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0),
+        timeout=30.0
+    )
+    
     try:
-        # Initialize integrations
-        whatsapp = WhatsAppIntegration()
-        # gmail = GmailIntegration()
-        calendar = CalendarIntegration()
-        hitl_manager = HITLManager()
+        # Initialize integrations in parallel - constructors do blocking I/O (OAuth, token and config loads)
+        whatsapp, calendar, hitl_manager = await asyncio.gather(
+            asyncio.to_thread(WhatsAppIntegration, http=app.state.http),
+            # asyncio.to_thread(GmailIntegration),
+            asyncio.to_thread(CalendarIntegration),
+            asyncio.to_thread(HITLManager)
+        )
+        
+        # Persist HITL config changes in the background
+        hitl_manager.start()
         
         # Initialize message router
         router = MessageRouter(whatsapp, None, calendar, hitl_manager)
         
+        # Handlers return plain dicts/Responses - none should be re-validated against a response model
+        for route in app.routes:
+            if getattr(route, "response_model", None) is not None:
+                logger.warning(f"Route {route.path} has a response_model and will be re-validated on every response")
+        
         # Start background tasks
         await router.start_background_tasks_async()
         
@@ -63,14 +104,25 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down Personal WhatsApp Assistant...")
+    if router:
+        await router.stop_background_tasks()
+    if hitl_manager:
+        await hitl_manager.stop()
+    if whatsapp:
+        await whatsapp.aclose()
+    await app.state.http.aclose()
 
 app = FastAPI(
     title="Personal WhatsApp Assistant",
     description="AI-powered personal assistant for WhatsApp with email and calendar integration",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
+# Request logging (pure ASGI - don't use @app.middleware("http") for new middlewares)
+app.add_middleware(AccessLogMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -80,17 +132,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/")
+# Compress larger responses (added last so it wraps CORS and runs outermost)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+@app.get("/", response_class=ORJSONResponse)
 async def root():
     """Root endpoint"""
-    return {"message": "Personal WhatsApp Assistant is running", "status": "healthy"}
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
-@app.get("/health")
+@app.get("/health", response_class=ORJSONResponse)
 async def health_check():
     """Health check endpoint for deployment platforms"""
-    return {"status": "healthy", "service": "whatsapp-assistant"}
+    return Response(content=_HEALTH_BODY, media_type="application/json")
+
+async def _read_body_limited(request: Request, limit: int) -> bytes:
+    """Read the request body, rejecting it with 413 as soon as it exceeds limit bytes"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    
+    # Content-Length may be missing (chunked) or wrong, so also enforce while streaming
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="Payload too large")
+        chunks.append(chunk)
+    
+    return b"".join(chunks)
 
-@app.post("/whatsapp-webhook")
+@app.post("/whatsapp-webhook", response_class=ORJSONResponse)
 async def whatsapp_webhook(request: Request):
     """
     Main webhook endpoint for receiving WhatsApp messages from UltraMsg
@@ -98,19 +170,25 @@ async def whatsapp_webhook(request: Request):
     if router is None:
         raise HTTPException(status_code=503, detail="Router not initialized")
     
+    # Get the raw body (oversized payloads are rejected before buffering)
+    body = await _read_body_limited(request, MAX_WEBHOOK_BODY_BYTES)
+    
     try:
-        # Get the raw body
-        body = await request.body()
-        data = json.loads(body)
+        data = orjson.loads(body)
         
-        logger.info(f"Received WhatsApp webhook: {data}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Received WhatsApp webhook: %s", data)
         
-        # Process the message through the router
+        # Queue the message for the router's workers
         response = await router.process_message(data)
         
-        return {"status": "success", "response": response}
+        # Only acknowledge once the message is queued; a 503 makes UltraMsg retry it
+        if response.get("status") == "overloaded":
+            return ORJSONResponse({"detail": response["message"]}, status_code=503, headers={"Retry-After": "5"})
+        
+        return ORJSONResponse({"status": "success", "response": response})
         
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error("Invalid JSON in webhook request")
         raise HTTPException(status_code=400, detail="Invalid JSON")
     except Exception as e:
@@ -163,18 +241,27 @@ async def whatsapp_webhook(request: Request):
 #         logger.error(f"Error processing Calendar webhook: {str(e)}")
 #         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/status")
+@app.get("/status", response_class=ORJSONResponse)
 async def get_status():
     """Get status of all integrations"""
     if not all([whatsapp, calendar, hitl_manager]):
         return {"error": "Integrations not initialized"}
     
-    return {
+    now = time.monotonic()
+    if _status_cache["value"] is not None and now - _status_cache["ts"] < STATUS_CACHE_TTL:
+        return _status_cache["value"]
+    
+    status = {
         "whatsapp": whatsapp.get_status(),
         # "gmail": gmail.get_status(),
         "calendar": calendar.get_status(),
-        "hitl": hitl_manager.get_status()
+        "hitl": hitl_manager.get_status(),
+        "message_queue": router.get_queue_stats()
     }
+    _status_cache["ts"] = now
+    _status_cache["value"] = status
+    
+    return status
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -182,6 +269,9 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        loop=UVICORN_LOOP,
+        http="httptools",
+        log_level="info",
+        access_log=False  # Requests are logged by AccessLogMiddleware
     )
 
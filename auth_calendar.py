@@ -8,16 +8,11 @@ import os
 import json
 import logging
 from datetime import datetime
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+from importlib.util import find_spec
+from flask import Flask, request, jsonify, redirect, url_for
 
-try:
-    from google.auth.transport.requests import Request
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import InstalledAppFlow
-    from googleapiclient.discovery import build
-    CALENDAR_AVAILABLE = True
-except ImportError:
-    CALENDAR_AVAILABLE = False
+# Google libraries are imported lazily in the handlers that need them; only check they are installed
+CALENDAR_AVAILABLE = find_spec("google_auth_oauthlib") is not None  # Pulls in google-auth as a dependency
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +25,8 @@ SCOPES = [
     'https://www.googleapis.com/auth/calendar.readonly'
 ]
 
+CALENDAR_LIST_URL = 'https://www.googleapis.com/calendar/v3/users/me/calendarList'
+
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -125,10 +122,17 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Compile the template once (Flask's jinja_env keeps HTML autoescaping) instead of per request
+PAGE_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
+def render_page(**context):
+    """Render the authentication page with the given context"""
+    return PAGE_TEMPLATE.render(**context)
+
 @app.route('/')
 def index():
     """Main authentication page"""
-    return render_template_string(HTML_TEMPLATE)
+    return render_page()
 
 @app.route('/', methods=['POST'])
 def handle_auth():
@@ -146,14 +150,14 @@ def handle_credentials_upload():
     """Handle credentials file upload"""
     try:
         if 'credentials_file' not in request.files:
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="No file uploaded", 
                 message_type="error",
                 message_title="Upload Error")
         
         file = request.files['credentials_file']
         if file.filename == '':
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="No file selected", 
                 message_type="error",
                 message_title="Upload Error")
@@ -164,15 +168,17 @@ def handle_credentials_upload():
         
         # Validate credentials format
         if 'installed' not in credentials_json and 'web' not in credentials_json:
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="Invalid credentials format. Please upload a valid Google OAuth2 credentials file.", 
                 message_type="error",
                 message_title="Invalid File")
         
         # Store credentials in session (in production, use proper session storage)
+        # Keep the raw text for display and the parsed config for the OAuth flow
         app.config['CREDENTIALS_DATA'] = credentials_data
+        app.config['CREDENTIALS_CONFIG'] = credentials_json
         
-        return render_template_string(HTML_TEMPLATE, 
+        return render_page(
             message="Credentials uploaded successfully! You can now authenticate with Google.", 
             message_type="success",
             message_title="Upload Successful",
@@ -180,7 +186,7 @@ def handle_credentials_upload():
             
     except Exception as e:
         logger.error(f"Error uploading credentials: {str(e)}")
-        return render_template_string(HTML_TEMPLATE, 
+        return render_page(
             message=f"Error processing credentials: {str(e)}", 
             message_type="error",
             message_title="Upload Error")
@@ -189,45 +195,36 @@ def handle_google_auth():
     """Handle Google OAuth2 authentication"""
     try:
         if not CALENDAR_AVAILABLE:
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="Google Calendar libraries not installed. Please install google-api-python-client and google-auth-oauthlib", 
                 message_type="error",
                 message_title="Missing Dependencies")
         
-        credentials_data = app.config.get('CREDENTIALS_DATA')
-        if not credentials_data:
-            return render_template_string(HTML_TEMPLATE, 
+        credentials_config = app.config.get('CREDENTIALS_CONFIG')
+        if not credentials_config:
+            return render_page(
                 message="Please upload credentials file first", 
                 message_type="error",
                 message_title="No Credentials")
         
-        # Create temporary credentials file
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            f.write(credentials_data)
-            credentials_file = f.name
+        from google_auth_oauthlib.flow import InstalledAppFlow
         
-        try:
-            # Create OAuth2 flow
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, SCOPES)
-            auth_url, _ = flow.authorization_url(prompt='consent')
-            
-            # Store flow in session for later use
-            app.config['OAUTH_FLOW'] = flow
-            
-            return render_template_string(HTML_TEMPLATE, 
-                message="Click the link below to authenticate with Google", 
-                message_type="info",
-                message_title="Authentication Required",
-                auth_url=auth_url)
-                
-        finally:
-            # Clean up temporary file
-            os.unlink(credentials_file)
+        # Create OAuth2 flow straight from the parsed config (no temporary file)
+        flow = InstalledAppFlow.from_client_config(credentials_config, SCOPES)
+        auth_url, _ = flow.authorization_url(prompt='consent')
+        
+        # Store flow in session for later use
+        app.config['OAUTH_FLOW'] = flow
+        
+        return render_page(
+            message="Click the link below to authenticate with Google", 
+            message_type="info",
+            message_title="Authentication Required",
+            auth_url=auth_url)
             
     except Exception as e:
         logger.error(f"Error setting up Google auth: {str(e)}")
-        return render_template_string(HTML_TEMPLATE, 
+        return render_page(
             message=f"Error setting up authentication: {str(e)}", 
             message_type="error",
             message_title="Authentication Error")
@@ -238,14 +235,14 @@ def auth_callback():
     try:
         code = request.args.get('code')
         if not code:
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="No authorization code received", 
                 message_type="error",
                 message_title="Authentication Failed")
         
         flow = app.config.get('OAUTH_FLOW')
         if not flow:
-            return render_template_string(HTML_TEMPLATE, 
+            return render_page(
                 message="Authentication session expired. Please start over.", 
                 message_type="error",
                 message_title="Session Expired")
@@ -254,9 +251,15 @@ def auth_callback():
         flow.fetch_token(code=code)
         credentials = flow.credentials
         
-        # Test the credentials
-        service = build('calendar', 'v3', credentials=credentials)
-        calendar_list = service.calendarList().list().execute()
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        
+        # Test the credentials with a pooled keep-alive session (no discovery client needed)
+        session = AuthorizedSession(credentials)
+        session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50))
+        response = session.get(CALENDAR_LIST_URL)
+        response.raise_for_status()
+        calendar_list = response.json()
         
         # Prepare tokens for display
         tokens = {
@@ -264,7 +267,7 @@ def auth_callback():
             'token': credentials.to_json()
         }
         
-        return render_template_string(HTML_TEMPLATE, 
+        return render_page(
             message="Authentication successful! Your tokens are ready.", 
             message_type="success",
             message_title="✅ Success!",
@@ -272,7 +275,7 @@ def auth_callback():
             
     except Exception as e:
         logger.error(f"Error in auth callback: {str(e)}")
-        return render_template_string(HTML_TEMPLATE, 
+        return render_page(
             message=f"Authentication failed: {str(e)}", 
             message_type="error",
             message_title="Authentication Failed")
@@ -7,6 +7,22 @@ import os
 import uvicorn
 from dotenv import load_dotenv
 
+try:
+    import uvloop  # noqa: F401
+    UVICORN_LOOP = "uvloop"
+except ImportError:
+    # uvloop is not available on Windows, fall back to the default asyncio loop
+    UVICORN_LOOP = "asyncio"
+
+def get_worker_count() -> int:
+    """Number of uvicorn workers from WEB_CONCURRENCY ("auto" sizes to CPU count)"""
+    # Router, HITL and conversation state live in process memory, so keep a single
+    # worker unless that state has been moved to a shared store (Redis, queue, ...)
+    workers = os.getenv("WEB_CONCURRENCY", "1")
+    if workers == "auto":
+        return (os.cpu_count() or 1) * 2 + 1
+    return max(1, int(workers))
+
 def main():
     """Run the production server"""
     # Load environment variables
@@ -15,6 +31,7 @@ def main():
     # Production configuration
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
+    workers = get_worker_count()
     
     # Run with production settings
     uvicorn.run(
@@ -22,9 +39,11 @@ def main():
         host=host,
         port=port,
         reload=False,  # Disable reload in production
-        workers=1,     # Single worker for simplicity
+        workers=workers,
+        loop=UVICORN_LOOP,
+        http="httptools",
         log_level="info",
-        access_log=True
+        access_log=False  # Requests are logged by AccessLogMiddleware
     )
 
 if __name__ == "__main__":
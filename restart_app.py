@@ -9,17 +9,50 @@ import os
 import signal
 import time
 
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 def find_running_process():
     """Find the running app.py process"""
     try:
+        if PSUTIL_AVAILABLE:
+            # In-process scan instead of forking pgrep; match app.py exactly so
+            # this script (restart_app.py) never finds itself
+            own_pid = os.getpid()
+            return [p.pid for p in psutil.process_iter(['cmdline'])
+                    if p.pid != own_pid and p.info['cmdline']
+                    and any(os.path.basename(arg) == 'app.py' for arg in p.info['cmdline'])]
+        
         result = subprocess.run(['pgrep', '-f', 'app.py'], capture_output=True, text=True)
         if result.returncode == 0:
             pids = result.stdout.strip().split('\n')
-            return [int(pid) for pid in pids if pid]
+            return [int(pid) for pid in pids if pid and int(pid) != os.getpid()]
     except Exception as e:
         print(f"Error finding process: {e}")
     return []
 
+def wait_for_exit(pids, timeout=2.0):
+    """Wait up to timeout seconds for the given processes to exit"""
+    if PSUTIL_AVAILABLE:
+        procs = []
+        for pid in pids:
+            try:
+                procs.append(psutil.Process(pid))
+            except psutil.NoSuchProcess:
+                pass
+        psutil.wait_procs(procs, timeout=timeout)
+        return
+    
+    # Poll with exponential backoff, bounded by the deadline
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while time.monotonic() < deadline and find_running_process():
+        time.sleep(min(delay, max(0, deadline - time.monotonic())))
+        delay *= 2
+
 def stop_app():
     """Stop the running application"""
     pids = find_running_process()
@@ -34,8 +67,8 @@ def stop_app():
             except Exception as e:
                 print(f"Error stopping process {pid}: {e}")
         
-        # Wait a bit for graceful shutdown
-        time.sleep(2)
+        # Wait for graceful shutdown, returning as soon as the processes exit
+        wait_for_exit(pids, timeout=2)
         
         # Force kill if still running
         remaining_pids = find_running_process()
@@ -4,25 +4,103 @@ Handles open-ended questions, general chat, and intelligent responses
 """
 
 import os
+import re
+import asyncio
+import time
+import atexit
+import weakref
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Set
 from datetime import datetime
-import json
+from collections import deque
+from itertools import islice
+import orjson
+
+from src.persistence import atomic_write_json
 
 try:
-    from openai import OpenAI
+    import httpx
+    from openai import AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
     logging.warning("OpenAI library not installed. Please install openai")
 
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+PREFS_FILE = "user_conversation_prefs.json"
+MAX_FAVORITE_TOPICS = 10
+CONTEXT_TOKEN_BUDGET = 1500  # Max history tokens sent to the model per turn
+
+# Keywords used for simple topic extraction (matched as whole words)
+_TOPIC_KEYWORDS = {
+    "tecnología": ["tecnología", "tech", "computadora", "internet", "app", "software"],
+    "trabajo": ["trabajo", "trabajar", "oficina", "empleo", "negocio"],
+    "salud": ["salud", "médico", "ejercicio", "fitness", "bienestar"],
+    "entretenimiento": ["película", "música", "juego", "deporte", "fiesta"],
+    "viajes": ["viaje", "vacaciones", "turismo", "avión", "hotel"],
+    "comida": ["comida", "restaurante", "cocinar", "receta", "cena"]
+}
+_KEYWORD_TO_TOPIC = {keyword: topic for topic, keywords in _TOPIC_KEYWORDS.items() for keyword in keywords}
+# One alternation over every keyword, so a message is scanned once by the regex engine
+_KEYWORD_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, _KEYWORD_TO_TOPIC)) + r")\b", re.IGNORECASE)
+
+# Spanish day/month names, so the prompt date doesn't depend on the process locale
+_DAY_NAMES = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+_MONTH_NAMES = ("enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+                "agosto", "septiembre", "octubre", "noviembre", "diciembre")
+
+_encoding = None
+
+def _count_tokens(text: str) -> int:
+    """Count model tokens in text (approximated as ~4 characters per token without tiktoken)"""
+    global _encoding
+    if TIKTOKEN_AVAILABLE:
+        if _encoding is None:
+            _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+# Shared across ConversationAI instances so TCP/TLS connections are reused between turns
+_openai_client: Optional["AsyncOpenAI"] = None
+
+def _get_client(api_key: str) -> "AsyncOpenAI":
+    """Return the process-wide AsyncOpenAI client, creating it on first use"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+            )
+        )
+    return _openai_client
+
+# Live instances, flushed once at exit by a single handler (the set doesn't keep them alive)
+_instances: "weakref.WeakSet[ConversationAI]" = weakref.WeakSet()
+
+def _flush_all_preferences():
+    """Save unsaved preferences of every live ConversationAI"""
+    for conversation in list(_instances):
+        conversation._save_user_preferences()
+
+atexit.register(_flush_all_preferences)
+
 class ConversationAI:
     def __init__(self):
         self.client = None
-        self.conversation_history = []  # Store conversation context
+        self._api_key = os.getenv('OPENAI_API_KEY')
+        self.conversation_history = deque(maxlen=20)  # Store conversation context (last 20 messages)
+        self._history_tokens = deque(maxlen=20)  # Token count of each history message, parallel to conversation_history
         self.user_preferences = self._load_user_preferences()
+        self._prefs_dirty = False
+        _instances.add(self)  # Flushed on exit by _flush_all_preferences
         self.personality_traits = {
             "tone": "friendly",
             "formality": "casual",
@@ -30,15 +108,17 @@ class ConversationAI:
             "language": "spanish",
             "response_length": "medium"
         }
+        self._system_prompt_template: Optional[str] = None  # Cached static part of the system prompt
+        self._time_cache: Optional[Tuple[int, str, str]] = None  # (minute, time, date) for the system prompt
+        self._background_tasks: Set[asyncio.Task] = set()  # Strong refs so pending preference updates aren't GC'd
         if OPENAI_AVAILABLE:
             self._initialize_client()
     
     def _initialize_client(self):
-        """Initialize OpenAI client"""
+        """Initialize async OpenAI client (awaited calls yield to the event loop)"""
         try:
-            api_key = os.getenv('OPENAI_API_KEY')
-            if api_key:
-                self.client = OpenAI(api_key=api_key)
+            if self._api_key:
+                self.client = _get_client(self._api_key)
                 logger.info("OpenAI client initialized successfully")
             else:
                 logger.warning("OpenAI API key not found in environment variables")
@@ -50,18 +130,20 @@ class ConversationAI:
     def _load_user_preferences(self) -> Dict[str, Any]:
         """Load user conversation preferences"""
         try:
-            prefs_file = "user_conversation_prefs.json"
-            if os.path.exists(prefs_file):
-                with open(prefs_file, 'r') as f:
-                    return json.load(f)
-            else:
+            try:
+                with open(PREFS_FILE, 'rb') as f:
+                    prefs = orjson.loads(f.read())
+            except FileNotFoundError:
                 # Default preferences
-                return {
+                prefs = {
                     "favorite_topics": [],
                     "communication_style": "friendly",
                     "interests": [],
                     "conversation_memory": True
                 }
+            # Kept as an insertion-ordered dict in memory for O(1) membership checks
+            prefs["favorite_topics"] = dict.fromkeys(islice(prefs.get("favorite_topics", []), MAX_FAVORITE_TOPICS))
+            return prefs
         except Exception as e:
             logger.error(f"Error loading user preferences: {str(e)}")
             return {}
@@ -71,7 +153,7 @@ class ConversationAI:
         return {
             "available": OPENAI_AVAILABLE,
             "configured": self.client is not None,
-            "api_key_set": bool(os.getenv('OPENAI_API_KEY')),
+            "api_key_set": bool(self._api_key),
             "conversation_history_length": len(self.conversation_history),
             "personality_traits": self.personality_traits
         }
@@ -92,22 +174,21 @@ class ConversationAI:
             return "Lo siento, no tengo acceso a la inteligencia artificial en este momento. ¿Puedo ayudarte con algo más?"
         
         try:
-            # Add to conversation history
-            self._add_to_history("user", message)
-            
             # Build enhanced system prompt
             system_prompt = self._build_enhanced_system_prompt(context, user_phone)
             
-            # Prepare conversation context
-            conversation_context = self._build_conversation_context()
+            # Messages in order: system prompt, prior history, current message
+            messages = [{"role": "system", "content": system_prompt}]
+            messages.extend(self._build_conversation_context())
+            messages.append({"role": "user", "content": message})
+            
+            # Add to conversation history (after building the context so the message isn't sent twice)
+            self._add_to_history("user", message)
             
             # Generate response
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=conversation_context + [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
+                messages=messages,
                 max_tokens=300,
                 temperature=0.7
             )
@@ -117,8 +198,10 @@ class ConversationAI:
             # Add to conversation history
             self._add_to_history("assistant", ai_response)
             
-            # Update user preferences based on conversation
-            self._update_user_preferences(message, ai_response)
+            # Update user preferences based on conversation, off the reply's critical path
+            task = asyncio.create_task(self._update_user_preferences_later(message, ai_response))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
             
             logger.info(f"Generated AI response: {ai_response[:100]}...")
             
@@ -155,13 +238,37 @@ class ConversationAI:
     
     def _build_enhanced_system_prompt(self, context: str, user_phone: str = None) -> str:
         """Build an enhanced system prompt with personality and context"""
-        current_time = datetime.now().strftime("%H:%M")
-        current_date = datetime.now().strftime("%A, %d de %B de %Y")
+        if self._system_prompt_template is None:
+            self._system_prompt_template = self._build_system_prompt_template()
+        
+        time_str, date_str = self._current_time_strings()
+        return self._system_prompt_template.format(
+            time=time_str,
+            date=date_str,
+            context=context
+        )
+    
+    def _current_time_strings(self) -> Tuple[str, str]:
+        """Get the prompt's time and Spanish date strings, recomputed at most once per minute"""
+        minute = int(time.time()) // 60
+        if self._time_cache is None or self._time_cache[0] != minute:
+            now = datetime.now()
+            date_str = f"{_DAY_NAMES[now.weekday()]}, {now.day:02d} de {_MONTH_NAMES[now.month - 1]} de {now.year}"
+            self._time_cache = (minute, now.strftime("%H:%M"), date_str)
+        return self._time_cache[1], self._time_cache[2]
+    
+    def _build_system_prompt_template(self) -> str:
+        """Build the system prompt with personality and preferences filled in, leaving {time}, {date} and {context}"""
+        def escape(value: Any) -> str:
+            return str(value).replace("{", "{{").replace("}", "}}")
         
-        personality = self.personality_traits
+        personality = {key: escape(value) for key, value in self.personality_traits.items()}
         user_prefs = self.user_preferences
+        communication_style = escape(user_prefs.get('communication_style', 'friendly'))
+        favorite_topics = escape(', '.join(user_prefs.get('favorite_topics', [])))
+        interests = escape(', '.join(user_prefs.get('interests', [])))
         
-        system_prompt = f"""Eres un asistente de WhatsApp muy amigable y útil. Tu personalidad es {personality['tone']} y {personality['formality']}.
+        return f"""Eres un asistente de WhatsApp muy amigable y útil. Tu personalidad es {personality['tone']} y {personality['formality']}.
 
 PERSONALIDAD:
 - Tono: {personality['tone']}
@@ -171,14 +278,14 @@ PERSONALIDAD:
 - Longitud de respuesta: {personality['response_length']}
 
 CONTEXTO ACTUAL:
-- Hora: {current_time}
-- Fecha: {current_date}
-- Contexto: {context}
+- Hora: {{time}}
+- Fecha: {{date}}
+- Contexto: {{context}}
 
 PREFERENCIAS DEL USUARIO:
-- Estilo de comunicación: {user_prefs.get('communication_style', 'friendly')}
-- Temas favoritos: {', '.join(user_prefs.get('favorite_topics', []))}
-- Intereses: {', '.join(user_prefs.get('interests', []))}
+- Estilo de comunicación: {communication_style}
+- Temas favoritos: {favorite_topics}
+- Intereses: {interests}
 
 INSTRUCCIONES:
 - Responde en español de manera natural y amigable
@@ -189,34 +296,42 @@ INSTRUCCIONES:
 - Recuerda el contexto de la conversación anterior
 
 Responde de manera natural y amigable:"""
-        
-        return system_prompt
     
     def _build_conversation_context(self) -> List[Dict[str, str]]:
         """Build conversation context from history"""
-        # Keep only last 6 messages to avoid token limits
-        recent_history = self.conversation_history[-6:] if len(self.conversation_history) > 6 else self.conversation_history
-        
+        # Take the newest messages that fit in the token budget
+        # History entries are already in the chat API message shape, so no copying is needed
         context = []
-        for msg in recent_history:
-            context.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        used_tokens = 0
+        for msg, tokens in zip(reversed(self.conversation_history), reversed(self._history_tokens)):
+            used_tokens += tokens
+            if used_tokens > CONTEXT_TOKEN_BUDGET:
+                break
+            context.append(msg)
         
+        context.reverse()
         return context
     
     def _add_to_history(self, role: str, content: str):
         """Add message to conversation history"""
-        self.conversation_history.append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
+        # Stored in the chat API message shape; deque(maxlen=20) drops the oldest message automatically
+        self.conversation_history.append({"role": role, "content": content})
+        self._history_tokens.append(_count_tokens(content))  # Counted once here, summed per turn
+    
+    async def _update_user_preferences_later(self, user_message: str, ai_response: str):
+        """Update user preferences once generate_response has returned its reply, saving them off the event loop"""
+        self._update_user_preferences(user_message, ai_response)
+        if not self._prefs_dirty:
+            return
         
-        # Keep only last 20 messages to manage memory
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
+        # Serialize here for a consistent snapshot; write the file in a thread
+        payload = self._prefs_payload()
+        self._prefs_dirty = False
+        try:
+            await asyncio.to_thread(atomic_write_json, PREFS_FILE, payload)
+        except Exception as e:
+            self._prefs_dirty = True
+            logger.error(f"Error saving user preferences: {str(e)}")
     
     def _update_user_preferences(self, user_message: str, ai_response: str):
         """Update user preferences based on conversation"""
@@ -224,55 +339,50 @@ Responde de manera natural y amigable:"""
             # Simple topic extraction (can be enhanced)
             topics = self._extract_topics(user_message)
             if topics:
-                current_topics = self.user_preferences.get("favorite_topics", [])
+                current_topics = self.user_preferences.setdefault("favorite_topics", {})
+                previous_count = len(current_topics)
                 for topic in topics:
-                    if topic not in current_topics:
-                        current_topics.append(topic)
-                self.user_preferences["favorite_topics"] = current_topics[:10]  # Keep top 10
-            
-            # Save preferences
-            self._save_user_preferences()
+                    if len(current_topics) >= MAX_FAVORITE_TOPICS:  # Keep top 10
+                        break
+                    current_topics[topic] = None  # No-op for topics already present
+                if len(current_topics) != previous_count:
+                    self._system_prompt_template = None  # Preferences changed, rebuild prompt
+                    self._prefs_dirty = True
             
         except Exception as e:
             logger.error(f"Error updating user preferences: {str(e)}")
     
     def _extract_topics(self, message: str) -> List[str]:
         """Extract topics from user message"""
-        # Simple keyword-based topic extraction
-        topic_keywords = {
-            "tecnología": ["tecnología", "tech", "computadora", "internet", "app", "software"],
-            "trabajo": ["trabajo", "trabajar", "oficina", "empleo", "negocio"],
-            "salud": ["salud", "médico", "ejercicio", "fitness", "bienestar"],
-            "entretenimiento": ["película", "música", "juego", "deporte", "fiesta"],
-            "viajes": ["viaje", "vacaciones", "turismo", "avión", "hotel"],
-            "comida": ["comida", "restaurante", "cocinar", "receta", "cena"]
-        }
-        
-        message_lower = message.lower()
-        topics = []
-        
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in message_lower for keyword in keywords):
-                topics.append(topic)
-        
-        return topics
+        # Simple keyword-based topic extraction: one regex pass, deduplicated in order of appearance
+        return list(dict.fromkeys(_KEYWORD_TO_TOPIC[match.group(0).lower()] for match in _KEYWORD_RE.finditer(message)))
     
     def _save_user_preferences(self):
-        """Save user preferences to file"""
+        """Save user preferences to file if they changed since the last save"""
+        if not self._prefs_dirty:
+            return
+        
         try:
-            with open("user_conversation_prefs.json", 'w') as f:
-                json.dump(self.user_preferences, f, indent=2)
+            atomic_write_json(PREFS_FILE, self._prefs_payload())
+            self._prefs_dirty = False
         except Exception as e:
             logger.error(f"Error saving user preferences: {str(e)}")
     
+    def _prefs_payload(self) -> bytes:
+        """Serialize user preferences (favorite topics are stored as a list)"""
+        prefs = {**self.user_preferences, "favorite_topics": list(self.user_preferences.get("favorite_topics", {}))}
+        return orjson.dumps(prefs, option=orjson.OPT_INDENT_2)
+    
     def clear_conversation_history(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._history_tokens.clear()
         logger.info("Conversation history cleared")
     
     def update_personality(self, traits: Dict[str, Any]):
         """Update AI personality traits"""
         self.personality_traits.update(traits)
+        self._system_prompt_template = None  # Personality changed, rebuild prompt
         logger.info(f"Personality updated: {traits}")
     
     def get_conversation_summary(self) -> str:
@@ -280,7 +390,7 @@ Responde de manera natural y amigable:"""
         if not self.conversation_history:
             return "No hay conversación previa."
         
-        recent_messages = self.conversation_history[-5:]  # Last 5 messages
+        recent_messages = islice(self.conversation_history, max(0, len(self.conversation_history) - 5), None)  # Last 5 messages
         summary = "Conversación reciente:\n"
         
         for msg in recent_messages:
@@ -0,0 +1,124 @@
+"""
+LLM Response Cache
+Caches deterministic LLM answers in memory or Redis, keyed on the exact prompt
+"""
+
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import orjson
+
+try:
+    import redis.asyncio as redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_TTL_SECONDS = 3600
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry"""
+    
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (expires_at, value)
+    
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    async def set(self, key: str, value: str, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+class RedisCacheBackend:
+    """Redis-backed cache, shared across worker processes"""
+    
+    def __init__(self, url: str, prefix: str = "llm_cache:"):
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+    
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(self.prefix + key)
+    
+    async def set(self, key: str, value: str, ttl: int):
+        await self._client.set(self.prefix + key, value, ex=ttl)
+
+class LLMCache:
+    """Prompt-keyed cache for deterministic (temperature 0) LLM calls"""
+    
+    def __init__(self, redis_url: Optional[str] = None, max_size: int = DEFAULT_CACHE_SIZE,
+                 ttl: int = DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        
+        if redis_url and REDIS_AVAILABLE:
+            self.backend = RedisCacheBackend(redis_url)
+            self.backend_name = "redis"
+        else:
+            if redis_url:
+                logger.warning("REDIS_URL set but redis is not installed, using in-memory LLM cache")
+            self.backend = MemoryCacheBackend(max_size)
+            self.backend_name = "memory"
+    
+    @staticmethod
+    def make_key(model: str, system: str, prompt: str) -> str:
+        """
+        Hash a temperature 0 request into a cache key
+        
+        Args:
+            model: Model name
+            system: System instructions
+            prompt: Per-request user message
+        
+        Returns:
+            Hex SHA-256 of the canonical request
+        """
+        payload = orjson.dumps(
+            {"model": model, "system": system, "prompt": prompt, "temperature": 0},
+            option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha256(payload).hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached answer for key, or None on a miss (backend errors count as misses)"""
+        value = await self.peek(key)
+        if value is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return value
+    
+    async def peek(self, key: str) -> Optional[str]:
+        """Like get, but not counted in the hit/miss stats (for opportunistic reuse of another request's answer)"""
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {str(e)}")
+            return None
+    
+    async def set(self, key: str, value: str):
+        """Store an answer for key with the cache TTL"""
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"LLM cache store failed: {str(e)}")
+    
+    def get_status(self) -> Dict[str, Any]:
+        """Get backend and hit/miss counters"""
+        return {"backend": self.backend_name, "ttl": self.ttl, **self.stats}
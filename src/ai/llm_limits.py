@@ -0,0 +1,52 @@
+"""
+OpenAI Rate Limits
+Retry and concurrency limits shared by every module that calls the OpenAI API
+"""
+
+import os
+import asyncio
+from typing import AsyncIterator, TypeVar
+
+T = TypeVar("T")
+
+LLM_MAX_RETRIES = 6  # Retries with exponential backoff on 429/5xx/connection errors (OpenAI client built-in)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))
+
+# One process-wide cap on concurrent LLM calls, so bursts don't turn into 429 storms
+llm_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+_STREAM_END = object()
+
+async def limited_stream(stream: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    Read an LLM stream under llm_semaphore and re-yield its items
+    
+    The stream is drained into a queue by a background task, so the slot is released when
+    the upstream finishes rather than when a slow (or abandoned) consumer does.
+    
+    Args:
+        stream: Upstream async iterator, not yet started
+    
+    Yields:
+        The upstream items, in order (upstream errors are re-raised at the end)
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def pump():
+        try:
+            async with llm_semaphore:
+                async for item in stream:
+                    queue.put_nowait(item)
+        finally:
+            queue.put_nowait(_STREAM_END)
+    
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            yield item
+        await task
+    finally:
+        task.cancel()
@@ -4,15 +4,24 @@ Handles generating suggested email responses based on user style and context
 """
 
 import os
+import re
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional, List
-import json
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
+from datetime import datetime, timedelta
+import orjson
+
+from .tokens import truncate_to_tokens
+from .llm_limits import LLM_MAX_RETRIES, llm_semaphore, limited_stream
+from src.persistence import atomic_write_json
 
 try:
-    from langchain_openai import OpenAI
-    from langchain.prompts import PromptTemplate
-    from langchain.chains import LLMChain
-    from langchain_core.output_parsers import BaseOutputParser
+    import httpx
+    from langchain_openai import ChatOpenAI
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import BaseOutputParser, StrOutputParser
     from langchain_community.callbacks.manager import get_openai_callback
     LANGCHAIN_AVAILABLE = True
 except ImportError:
@@ -21,45 +30,93 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Meeting detection, compiled once at import. Text is accent-folded before matching,
+# so keywords are written without accents ("manana" also matches "mañana")
+_STRIP_ACCENTS = str.maketrans("áéíóúüñÁÉÍÓÚÜÑ", "aeiouunAEIOUUN")
+_MEETING_KEYWORDS = frozenset({'manana', 'tomorrow', 'reunion', 'meeting', 'cita', 'appointment'})
+# All keywords in one alternation so detection is a single scan (substring match, like `in`)
+_MEETING_KEYWORDS_RE = re.compile("|".join(map(re.escape, sorted(_MEETING_KEYWORDS))))
+_TIME_RE = re.compile(r'(\d{1,2}):?(\d{0,2})\s*(am|pm|a\.m\.|p\.m\.)', re.IGNORECASE)
+
+# Alternative meeting slots offered when the requested time is busy: (hour, minute, "%I:%M %p" label)
+_MEETING_SLOTS = tuple(
+    (hour, minute, f"{(hour - 1) % 12 + 1:02d}:{minute:02d} {'PM' if hour >= 12 else 'AM'}")
+    for hour, minute in ((9, 0), (10, 0), (11, 0), (14, 0), (15, 0), (16, 0), (17, 0))
+)
+
+STYLE_FILE = "user_style.json"
+MAX_CONTENT_TOKENS = 500  # Email body budget in the response prompt (~2000 characters)
+RESPONSE_CACHE_SIZE = 256  # Generated responses kept for identical (sender, subject, content, summary) inputs
+
+# Labeled lines the response parser recognizes: (lowercase prefix, response field)
+_FIELD_PREFIXES = (
+    ("respuesta:", "response"),
+    ("tono:", "tone"),
+    ("confianza:", "confidence"),
+    ("response:", "response"),
+    ("tone:", "tone"),
+    ("confidence:", "confidence"),
+)
+
+# Chat models shared by all responders, keyed by (api_key, model, temperature, max_tokens),
+# so every instance reuses the same warm HTTP connection pool
+_llm_cache: Dict[Tuple[str, str, float, int], Any] = {}
+_http_async_client = None
+
+def _get_llm(api_key: str, model: str, temperature: float, max_tokens: int):
+    """Return the shared chat model for these settings, creating it on first use"""
+    global _http_async_client
+    key = (api_key, model, temperature, max_tokens)
+    llm = _llm_cache.get(key)
+    if llm is None:
+        if _http_async_client is None:
+            _http_async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        llm = ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            max_retries=LLM_MAX_RETRIES,
+            openai_api_key=api_key,
+            http_async_client=_http_async_client
+        )
+        _llm_cache[key] = llm
+    return llm
+
 class ResponseOutputParser(BaseOutputParser):
     """Custom parser for response generation output"""
     
     def parse(self, text: str) -> Dict[str, Any]:
         """Parse the LLM output into structured response data"""
         try:
+            stripped = text.strip()
+            
             # Try to parse as JSON first (fallback for old format)
-            if text.strip().startswith('{'):
-                return json.loads(text)
+            if stripped[:1] == '{':
+                return orjson.loads(stripped)
             
             # For the new simple format, the entire text is the response
             response_data = {
-                "response": text.strip(),
+                "response": stripped,
                 "tone": "professional",
                 "confidence": "high",
                 "suggestions": []
             }
             
-            # Try to extract structured data if present
-            lines = text.strip().split('\n')
-            for line in lines:
+            # Try to extract structured data if present (Spanish or English labels)
+            for line in stripped.splitlines():
                 line = line.strip()
                 if not line:
                     continue
                 
-                # Handle Spanish format
-                if line.lower().startswith("respuesta:"):
-                    response_data["response"] = line[10:].strip()
-                elif line.lower().startswith("tono:"):
-                    response_data["tone"] = line[5:].strip().lower()
-                elif line.lower().startswith("confianza:"):
-                    response_data["confidence"] = line[9:].strip().lower()
-                # Fallback for English format
-                elif line.lower().startswith("response:"):
-                    response_data["response"] = line[9:].strip()
-                elif line.lower().startswith("tone:"):
-                    response_data["tone"] = line[5:].strip().lower()
-                elif line.lower().startswith("confidence:"):
-                    response_data["confidence"] = line[10:].strip().lower()
+                line_lower = line.lower()
+                for prefix, field in _FIELD_PREFIXES:
+                    if line_lower.startswith(prefix):
+                        # Keep the response's original casing; tone/confidence come from the lowered line
+                        source = line if field == "response" else line_lower
+                        response_data[field] = source[len(prefix):].strip()
+                        break
             
             return response_data
             
@@ -73,12 +130,18 @@ class ResponseOutputParser(BaseOutputParser):
             }
 
 class EmailResponder:
+    _style_cache: Optional[Tuple[float, Dict[str, Any]]] = None  # (mtime, parsed user_style.json), shared by instances
+    
     def __init__(self, calendar_integration=None):
         self.llm = None
         self.response_chain = None
+        self.response_stream = None
         self.rewrite_chain = None
+        self._api_key = os.getenv("OPENAI_API_KEY")  # Read once; get_status is polled by health checks
         self.user_style = self._load_user_style()
+        self._style_kwargs = self._build_style_kwargs(self.user_style)  # Rewrite prompt fields, rebuilt on style change
         self.calendar = calendar_integration
+        self._response_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # LRU of generated responses
         
         if LANGCHAIN_AVAILABLE:
             self._initialize_llm()
@@ -88,18 +151,16 @@ class EmailResponder:
         return {
             "available": LANGCHAIN_AVAILABLE,
             "initialized": self.llm is not None,
-            "api_key_set": bool(os.getenv("OPENAI_API_KEY")),
+            "api_key_set": bool(self._api_key),
             "user_style_loaded": bool(self.user_style)
         }
     
     def _load_user_style(self) -> Dict[str, Any]:
-        """Load user's writing style preferences"""
+        """Load user's writing style preferences (parsed file is cached until its mtime changes)"""
         try:
-            style_file = "user_style.json"
-            if os.path.exists(style_file):
-                with open(style_file, 'r') as f:
-                    return json.load(f)
-            else:
+            try:
+                mtime = os.stat(STYLE_FILE).st_mtime
+            except FileNotFoundError:
                 # Default style
                 return {
                     "tone": "professional",
@@ -111,6 +172,13 @@ class EmailResponder:
                     "avoid_phrases": [],
                     "signature": ""
                 }
+            
+            cached = EmailResponder._style_cache
+            if cached is None or cached[0] != mtime:
+                with open(STYLE_FILE, 'rb') as f:
+                    cached = (mtime, orjson.loads(f.read()))
+                EmailResponder._style_cache = cached
+            return dict(cached[1])
         except Exception as e:
             logger.error(f"Error loading user style: {str(e)}")
             return {}
@@ -118,91 +186,80 @@ class EmailResponder:
     def _initialize_llm(self):
         """Initialize the OpenAI LLM"""
         try:
-            api_key = os.getenv("OPENAI_API_KEY")
+            api_key = self._api_key
             if not api_key:
                 logger.warning("OPENAI_API_KEY not set")
                 return
             
-            self.llm = OpenAI(
-                temperature=0.7,
-                max_tokens=1200,
-                openai_api_key=api_key
-            )
+            # Chat model so the static instructions can go in a system message; OpenAI caches
+            # that identical prompt prefix across calls automatically
+            self.llm = _get_llm(api_key, "gpt-4o-mini", 0.7, 1200)
             
-            # Create response generation prompt template
-            response_template = """
-            Eres un asistente que responde correos electrónicos. Responde SOLO con el texto del correo, sin explicaciones adicionales.
+            # Create response generation prompt: static instructions first, per-email fields last
+            response_instructions = """Eres un asistente que responde correos electrónicos. Responde SOLO con el texto del correo, sin explicaciones adicionales.
 
-            CONTEXTO: Este es un correo de respuesta a una conversación que TÚ (el asistente) inició preguntando sobre una reunión. La persona está respondiendo a tu solicitud original.
+CONTEXTO: Este es un correo de respuesta a una conversación que TÚ (el asistente) inició preguntando sobre una reunión. La persona está respondiendo a tu solicitud original.
 
-            Correo a responder:
-            De: {sender}
-            Asunto: {subject}
-            Contenido: {content}
-            
-            Resumen: {summary}
-            
-            INSTRUCCIONES IMPORTANTES:
-            - Si la persona dice que NO puede reunirse en el horario que propusiste, responde que entiendes y pregunta por otros horarios disponibles
-            - Si la persona dice que SÍ puede reunirse, confirma la reunión
-            - Si la persona sugiere un horario diferente, responde si te funciona o sugiere alternativas
-            - Usa un tono casual y amigable en español
-            - NO uses lenguaje formal
-            
-            Escribe una respuesta en español que incluya:
-            - Saludo casual
-            - Respuesta apropiada al contenido del correo
-            - Despedida amigable
-            
-            Respuesta:"""
-            
-            response_prompt = PromptTemplate(
-                input_variables=["sender", "subject", "content", "summary"],
-                template=response_template
-            )
+INSTRUCCIONES IMPORTANTES:
+- Si la persona dice que NO puede reunirse en el horario que propusiste, responde que entiendes y pregunta por otros horarios disponibles
+- Si la persona dice que SÍ puede reunirse, confirma la reunión
+- Si la persona sugiere un horario diferente, responde si te funciona o sugiere alternativas
+- Usa un tono casual y amigable en español
+- NO uses lenguaje formal
+
+Escribe una respuesta en español que incluya:
+- Saludo casual
+- Respuesta apropiada al contenido del correo
+- Despedida amigable"""
+            
+            response_email = """Correo a responder:
+De: {sender}
+Asunto: {subject}
+Contenido: {content}
+
+Resumen: {summary}
+
+Respuesta:"""
             
-            self.response_chain = LLMChain(
-                llm=self.llm,
-                prompt=response_prompt,
-                output_parser=ResponseOutputParser()
-            )
+            response_prompt = ChatPromptTemplate.from_messages([
+                ("system", response_instructions),
+                ("human", response_email)
+            ])
             
-            # Create rewrite prompt template
-            rewrite_template = """
-            Reescribe la siguiente respuesta de correo electrónico según las preferencias de estilo del usuario:
-            
-            Respuesta Original:
-            {original_response}
-            
-            Estilo del Usuario:
-            - Tono: {tone}
-            - Formalidad: {formality}
-            - Longitud: {length_preference}
-            - Saludo: {greeting_style}
-            - Despedida: {closing_style}
-            - Frases comunes: {common_phrases}
-            - Evitar frases: {avoid_phrases}
-            
-            Instrucciones:
-            1. Mantén el mensaje central pero ajusta el tono y estilo
-            2. Usa el saludo y despedida preferidos del usuario
-            3. Incorpora frases comunes si es apropiado
-            4. Evita frases que al usuario no le gustan
-            5. Ajusta el nivel de formalidad según se solicite
-            
-            Devuelve solo el texto de la respuesta reescrita en español.
-            """
+            # LCEL pipelines: parsed dict for full responses, raw text chunks for streaming
+            self.response_chain = response_prompt | self.llm | ResponseOutputParser()
+            self.response_stream = response_prompt | self.llm | StrOutputParser()
             
-            rewrite_prompt = PromptTemplate(
-                input_variables=["original_response", "tone", "formality", "length_preference",
-                               "greeting_style", "closing_style", "common_phrases", "avoid_phrases"],
-                template=rewrite_template
-            )
+            # Create rewrite prompt: static instructions first, response and style last
+            rewrite_instructions = """Reescribe respuestas de correo electrónico según las preferencias de estilo del usuario.
+
+Instrucciones:
+1. Mantén el mensaje central pero ajusta el tono y estilo
+2. Usa el saludo y despedida preferidos del usuario
+3. Incorpora frases comunes si es apropiado
+4. Evita frases que al usuario no le gustan
+5. Ajusta el nivel de formalidad según se solicite
+
+Devuelve solo el texto de la respuesta reescrita en español."""
             
-            self.rewrite_chain = LLMChain(
-                llm=self.llm,
-                prompt=rewrite_prompt
-            )
+            rewrite_request = """Respuesta Original:
+{original_response}
+
+Estilo del Usuario:
+- Tono: {tone}
+- Formalidad: {formality}
+- Longitud: {length_preference}
+- Saludo: {greeting_style}
+- Despedida: {closing_style}
+- Frases comunes: {common_phrases}
+- Evitar frases: {avoid_phrases}"""
+            
+            rewrite_prompt = ChatPromptTemplate.from_messages([
+                ("system", rewrite_instructions),
+                ("human", rewrite_request)
+            ])
+            
+            self.rewrite_chain = rewrite_prompt | self.llm | StrOutputParser()
             
             logger.info("Email responder initialized successfully")
             
@@ -216,27 +273,16 @@ class EmailResponder:
             return {"available": True, "suggestions": []}
         
         try:
-            import re
-            from datetime import datetime, timedelta
-            
-            # Extract time information from email content and summary
-            time_patterns = [
-                r'(\d{1,2}):(\d{2})\s*(am|pm|a\.m\.|p\.m\.)?',
-                r'(\d{1,2})\s*(am|pm|a\.m\.|p\.m\.)',
-                r'mañana|tomorrow|tomorrow',
-                r'(\d{1,2})\s*de\s*(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)',
-            ]
-            
             # Look for time mentions in the content
-            content_lower = (email_content + " " + summary).lower()
+            content_lower = f"{email_content} {summary}".translate(_STRIP_ACCENTS).lower()
             
             # Check if it mentions tomorrow or specific times
-            if any(word in content_lower for word in ['mañana', 'tomorrow', 'reunión', 'meeting', 'cita', 'appointment']):
+            if _MEETING_KEYWORDS_RE.search(content_lower):
                 tomorrow = datetime.now() + timedelta(days=1)
                 
                 # First, check if a specific time is mentioned (like 4 p.m.)
                 specific_time = None
-                time_match = re.search(r'(\d{1,2}):?(\d{0,2})\s*(am|pm|a\.m\.|p\.m\.)', content_lower)
+                time_match = _TIME_RE.search(content_lower)
                 if time_match:
                     hour = int(time_match.group(1))
                     minute = int(time_match.group(2)) if time_match.group(2) else 0
@@ -269,24 +315,18 @@ class EmailResponder:
                     }
                 else:
                     # If not available, find alternative times
-                    meeting_times = [
-                        (9, 0),   # 9:00 AM
-                        (10, 0),  # 10:00 AM
-                        (11, 0),  # 11:00 AM
-                        (14, 0),  # 2:00 PM
-                        (15, 0),  # 3:00 PM
-                        (16, 0),  # 4:00 PM
-                        (17, 0),  # 5:00 PM
-                    ]
+                    # Check all alternative slots with a single calendar query
+                    alt_starts = [tomorrow.replace(hour=hour, minute=minute, second=0, microsecond=0)
+                                  for hour, minute, _ in _MEETING_SLOTS]
+                    alt_results = await self.calendar.check_availability_many(
+                        [(alt_start, alt_start + timedelta(hours=1)) for alt_start in alt_starts]
+                    )
                     
-                    available_times = []
-                    for hour, minute in meeting_times:
-                        alt_start = tomorrow.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                        alt_end = alt_start + timedelta(hours=1)
-                        
-                        alt_availability = await self.calendar.check_availability(alt_start, alt_end)
-                        if alt_availability.get("available", False):
-                            available_times.append(alt_start.strftime("%I:%M %p"))
+                    available_times = [
+                        label
+                        for (_, _, label), alt_availability in zip(_MEETING_SLOTS, alt_results)
+                        if alt_availability.get("available", False)
+                    ]
                     
                     return {
                         "available": False,
@@ -311,65 +351,201 @@ class EmailResponder:
             Generated response with metadata
         """
         if not self.response_chain:
-            return {
-                "response": "AI response generation not available",
-                "tone": "professional",
-                "confidence": "low",
-                "suggestions": [],
-                "error": "Responder not initialized"
-            }
+            return self._unavailable_response()
         
         try:
-            # Extract information
-            sender = email_data.get("sender", "Unknown")
-            subject = email_data.get("subject", "No subject")
-            content = email_data.get("body", "")
-            summary = summary_data.get("summary", "")
-            
-            # Truncate content if too long
-            if len(content) > 2000:
-                content = content[:2000] + "..."
-            
-            # Check calendar availability for meeting requests
-            availability_info = await self._check_meeting_availability(content, summary)
-            
-            # Modify the prompt based on availability
-            if not availability_info.get("available", True):
-                # If not available, include alternative times in the prompt
-                suggestions = availability_info.get("suggestions", [])
-                if suggestions:
-                    summary += f"\n\nNota: No estoy disponible en el horario solicitado. Horarios alternativos disponibles: {', '.join(suggestions)}"
-                else:
-                    summary += "\n\nNota: No estoy disponible en el horario solicitado. Por favor sugiere otros horarios."
-            
-            # Generate response
-            with get_openai_callback() as cb:
-                result = self.response_chain.run(
-                    sender=sender,
-                    subject=subject,
-                    content=content,
-                    summary=summary
-                )
+            inputs = await self._prepare_response_inputs(email_data, summary_data)
+            
+            # Reuse the response for identical inputs (auto-replies, mailing lists, repeated threads)
+            cache_key = self._response_cache_key(**inputs)
+            result = self._get_cached_response(cache_key)
+            if result is None:
+                # Generate response
+                with get_openai_callback() as cb:
+                    result = await self._ainvoke(self.response_chain, inputs)
+                    
+                    logger.info(f"Response generated - Tokens used: {cb.total_tokens}")
+                    logger.info(f"Raw response: {result}")
                 
-                logger.info(f"Response generated - Tokens used: {cb.total_tokens}")
-                logger.info(f"Raw response: {result}")
+                self._cache_response(cache_key, result)
             
-            # Add metadata
-            result["original_email_id"] = email_data.get("id")
-            result["original_sender"] = sender
-            result["original_subject"] = subject
-            
-            return result
+            return self._add_response_metadata(result, email_data, inputs)
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
-            return {
-                "response": f"Error generating response: {str(e)}",
-                "tone": "professional",
-                "confidence": "low",
-                "suggestions": [],
-                "error": str(e)
-            }
+            return self._error_response(e)
+    
+    async def generate_responses(self, email_batch: List[Dict[str, Any]],
+                                 summary_batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Generate suggested responses for several emails with one batched LLM run
+        
+        Args:
+            email_batch: Original emails
+            summary_batch: Summaries from the summarizer, in the same order as email_batch
+        
+        Returns:
+            Generated responses with metadata, in input order
+        """
+        if not self.response_chain:
+            return [self._unavailable_response() for _ in email_batch]
+        
+        try:
+            inputs = await asyncio.gather(*(
+                self._prepare_response_inputs(email_data, summary_data)
+                for email_data, summary_data in zip(email_batch, summary_batch)
+            ))
+            cache_keys = [self._response_cache_key(**email_inputs) for email_inputs in inputs]
+            results = [self._get_cached_response(cache_key) for cache_key in cache_keys]
+            
+            # Only send cache misses to the model, concurrently within the shared OpenAI limit
+            pending = [index for index, result in enumerate(results) if result is None]
+            if pending:
+                with get_openai_callback() as cb:
+                    outputs = await asyncio.gather(
+                        *(self._ainvoke(self.response_chain, inputs[index]) for index in pending),
+                        return_exceptions=True
+                    )
+                    logger.info(f"Generated {len(pending)} responses - Tokens used: {cb.total_tokens}")
+                
+                for index, output in zip(pending, outputs):
+                    if isinstance(output, Exception):
+                        logger.error(f"Error generating response: {str(output)}")
+                        results[index] = self._error_response(output)
+                    else:
+                        results[index] = output
+                        self._cache_response(cache_keys[index], results[index])
+            
+            return [
+                result if "error" in result else self._add_response_metadata(result, email_data, email_inputs)
+                for result, email_data, email_inputs in zip(results, email_batch, inputs)
+            ]
+        
+        except Exception as e:
+            logger.error(f"Error generating responses: {str(e)}")
+            return [self._error_response(e) for _ in email_batch]
+    
+    async def stream_response(self, email_data: Dict[str, Any], summary_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Stream a suggested email response as it is generated
+        
+        Args:
+            email_data: Original email data
+            summary_data: Email summary from summarizer
+        
+        Yields:
+            Chunks of the response text (ending with an "Error generating response" chunk on failure)
+        """
+        if not self.response_stream:
+            yield self._unavailable_response()["response"]
+            return
+        
+        try:
+            inputs = await self._prepare_response_inputs(email_data, summary_data)
+            
+            cache_key = self._response_cache_key(**inputs)
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                yield cached["response"]
+                return
+            
+            chunks = []
+            async for chunk in limited_stream(self.response_stream.astream(inputs)):
+                chunks.append(chunk)
+                yield chunk
+            
+            # Cache the parsed result so generate_response can reuse it
+            self._cache_response(cache_key, ResponseOutputParser().parse("".join(chunks)))
+        
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            # Same text generate_response returns on failure, so callers don't mistake it for a blank reply
+            yield self._error_response(e)["response"]
+    
+    async def _prepare_response_inputs(self, email_data: Dict[str, Any], summary_data: Dict[str, Any]) -> Dict[str, str]:
+        """Build the response prompt inputs, including calendar availability notes"""
+        # Extract information
+        sender = email_data.get("sender", "Unknown")
+        subject = email_data.get("subject", "No subject")
+        content = email_data.get("body", "")
+        summary = summary_data.get("summary", "")
+        
+        # Truncate content if too long
+        content = truncate_to_tokens(content, MAX_CONTENT_TOKENS)
+        
+        # Check calendar availability for meeting requests
+        availability_info = await self._check_meeting_availability(content, summary)
+        
+        # Modify the prompt based on availability
+        if not availability_info.get("available", True):
+            # If not available, include alternative times in the prompt
+            suggestions = availability_info.get("suggestions", [])
+            if suggestions:
+                summary += f"\n\nNota: No estoy disponible en el horario solicitado. Horarios alternativos disponibles: {', '.join(suggestions)}"
+            else:
+                summary += "\n\nNota: No estoy disponible en el horario solicitado. Por favor sugiere otros horarios."
+        
+        return {"sender": sender, "subject": subject, "content": content, "summary": summary}
+    
+    def _get_cached_response(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached response, or None on a miss"""
+        cached = self._response_cache.get(cache_key)
+        if cached is None:
+            return None
+        self._response_cache.move_to_end(cache_key)
+        logger.info("Response served from cache")
+        return dict(cached)
+    
+    def _cache_response(self, cache_key: str, result: Dict[str, Any]):
+        """Store a response, evicting the least recently used one when full"""
+        self._response_cache[cache_key] = dict(result)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+    
+    @staticmethod
+    def _add_response_metadata(result: Dict[str, Any], email_data: Dict[str, Any], inputs: Dict[str, str]) -> Dict[str, Any]:
+        """Attach the original email's identifiers to a generated response"""
+        result["original_email_id"] = email_data.get("id")
+        result["original_sender"] = inputs["sender"]
+        result["original_subject"] = inputs["subject"]
+        return result
+    
+    @staticmethod
+    def _unavailable_response() -> Dict[str, Any]:
+        """Response returned when the LLM chain is not initialized"""
+        return {
+            "response": "AI response generation not available",
+            "tone": "professional",
+            "confidence": "low",
+            "suggestions": [],
+            "error": "Responder not initialized"
+        }
+    
+    @staticmethod
+    def _error_response(error: Exception) -> Dict[str, Any]:
+        """Response returned when generation fails"""
+        return {
+            "response": f"Error generating response: {str(error)}",
+            "tone": "professional",
+            "confidence": "low",
+            "suggestions": [],
+            "error": str(error)
+        }
+    
+    @staticmethod
+    async def _ainvoke(runnable, inputs):
+        """Invoke an LLM runnable under the shared concurrency limit"""
+        async with llm_semaphore:
+            return await runnable.ainvoke(inputs)
+    
+    @staticmethod
+    def _response_cache_key(sender: str, subject: str, content: str, summary: str) -> str:
+        """Hash the prompt inputs into a compact cache key"""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (sender, subject, content, summary):
+            digest.update(part.encode())
+            digest.update(b"\0")  # Separator so field boundaries can't collide
+        return digest.hexdigest()
     
     async def rewrite_response(self, response: str, style_preferences: Dict[str, Any] = None) -> str:
         """
@@ -386,19 +562,10 @@ class EmailResponder:
             return response
         
         try:
-            # Use provided preferences or default user style
-            style = style_preferences or self.user_style
-            
-            result = self.rewrite_chain.run(
-                original_response=response,
-                tone=style.get("tone", "professional"),
-                formality=style.get("formality", "medium"),
-                length_preference=style.get("length_preference", "medium"),
-                greeting_style=style.get("greeting_style", "Hi"),
-                closing_style=style.get("closing_style", "Best regards"),
-                common_phrases=", ".join(style.get("common_phrases", [])),
-                avoid_phrases=", ".join(style.get("avoid_phrases", []))
-            )
+            # Use provided preferences or the precomputed default user style
+            style_kwargs = self._build_style_kwargs(style_preferences) if style_preferences else self._style_kwargs
+            
+            result = await self._ainvoke(self.rewrite_chain, {"original_response": response, **style_kwargs})
             
             return result.strip()
             
@@ -406,6 +573,19 @@ class EmailResponder:
             logger.error(f"Error rewriting response: {str(e)}")
             return response
     
+    @staticmethod
+    def _build_style_kwargs(style: Dict[str, Any]) -> Dict[str, str]:
+        """Build the rewrite prompt's style fields from a style dict"""
+        return {
+            "tone": style.get("tone", "professional"),
+            "formality": style.get("formality", "medium"),
+            "length_preference": style.get("length_preference", "medium"),
+            "greeting_style": style.get("greeting_style", "Hi"),
+            "closing_style": style.get("closing_style", "Best regards"),
+            "common_phrases": ", ".join(style.get("common_phrases", [])),
+            "avoid_phrases": ", ".join(style.get("avoid_phrases", []))
+        }
+    
     async def generate_meeting_response(self, email_data: Dict[str, Any], 
                                       available_times: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -460,7 +640,7 @@ class EmailResponder:
             Return only the email response text.
             """
             
-            response = self.llm(prompt)
+            response = (await self._ainvoke(self.llm, prompt)).content
             
             return {
                 "response": response.strip(),
@@ -479,7 +659,7 @@ class EmailResponder:
                 "suggestions": []
             }
     
-    def update_user_style(self, style_updates: Dict[str, Any]) -> bool:
+    async def update_user_style(self, style_updates: Dict[str, Any]) -> bool:
         """
         Update user's writing style preferences
         
@@ -492,10 +672,13 @@ class EmailResponder:
         try:
             # Update user style
             self.user_style.update(style_updates)
+            self._style_kwargs = self._build_style_kwargs(self.user_style)
+            self._response_cache.clear()
             
-            # Save to file
-            with open("user_style.json", 'w') as f:
-                json.dump(self.user_style, f, indent=2)
+            # Serialize here for a consistent snapshot; write the file off the event loop
+            style = dict(self.user_style)
+            mtime = await asyncio.to_thread(self._write_style_file, orjson.dumps(style, option=orjson.OPT_INDENT_2))
+            EmailResponder._style_cache = (mtime, style)
             
             logger.info("User style updated successfully")
             return True
@@ -503,3 +686,9 @@ class EmailResponder:
         except Exception as e:
             logger.error(f"Error updating user style: {str(e)}")
             return False
+    
+    @staticmethod
+    def _write_style_file(payload: bytes) -> float:
+        """Atomically replace the style file and return its new mtime"""
+        atomic_write_json(STYLE_FILE, payload)
+        return os.stat(STYLE_FILE).st_mtime
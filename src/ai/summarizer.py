@@ -4,102 +4,237 @@ Handles email summarization and content analysis
 """
 
 import os
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-import json
+from typing import Dict, Any, Optional, List, AsyncIterator
+import orjson
+
+from .llm_cache import LLMCache
+from .tokens import truncate_to_tokens
+from .llm_limits import LLM_MAX_RETRIES, llm_semaphore, limited_stream
+
+try:
+    from openai import AsyncOpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    logging.warning("OpenAI not installed. Please install openai")
 
 try:
-    from langchain_openai import OpenAI
-    from langchain.prompts import PromptTemplate
-    from langchain.chains import LLMChain
     from langchain_core.output_parsers import BaseOutputParser
-    from langchain_community.callbacks.manager import get_openai_callback
     LANGCHAIN_AVAILABLE = True
 except ImportError:
     LANGCHAIN_AVAILABLE = False
-    logging.warning("LangChain not installed. Please install langchain and openai")
 
 logger = logging.getLogger(__name__)
 
-class EmailSummaryOutputParser(BaseOutputParser):
-    """Custom parser for email summary output"""
+# Per-task model routing: full analysis/summaries vs. single-label categorization
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "gpt-4o-mini")
+BULK_BATCH_MIN_EMAILS = 50  # Below this the Batch API's turnaround isn't worth its 50% discount
+BULK_POLL_SECONDS = 30
+MAX_BODY_TOKENS = 750  # Email body budget in the summary/analysis prompts (~3000 characters)
+
+# Static system prompts, sent ahead of the per-email message so the prefix stays cacheable
+SUMMARY_INSTRUCTIONS = """Analiza el correo electrónico que te envíen y proporciona un resumen estructurado en español.
+
+Proporciona tu respuesta en el siguiente formato:
+
+Resumen: [Resumen breve del contenido del correo en español]
+
+Puntos clave:
+- [Punto 1]
+- [Punto 2]
+- [Punto 3]
+
+Acción requerida: [Sí/No]
+Urgencia: [baja/media/alta]
+Categoría: [trabajo/personal/urgente/reunión/spam/otro]"""
+
+SUMMARY_EMAIL_TEMPLATE = """De: {sender}
+Asunto: {subject}
+Fecha: {date}
+
+Contenido del correo:
+{body}"""
+
+# One call covers the summary, category, action items and context notes for an email
+FULL_ANALYSIS_INSTRUCTIONS = """Analiza el correo electrónico que te envíen y responde en español con:
+
+- summary: resumen breve del contenido del correo
+- key_points: los puntos clave (máximo 5)
+- action_required: si el correo requiere una acción del destinatario
+- urgency: low (baja), medium (media) o high (alta)
+- category: urgent (requiere atención inmediata), meeting (solicitud o agenda de reunión), work (trabajo no urgente), personal (comunicación personal), spam (spam o promocional) u other
+- action_items: tareas concretas, cada una con action, deadline (vacío si no se menciona) y priority (low/medium/high)
+- context_notes: intención y tono del remitente, fechas límite, contexto de la relación y cualquier adjunto o contexto adicional necesario, de forma concisa"""
+
+FULL_ANALYSIS_SCHEMA = {
+    "name": "email_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["summary", "key_points", "action_required", "urgency", "category", "action_items", "context_notes"],
+        "properties": {
+            "summary": {"type": "string"},
+            "key_points": {"type": "array", "items": {"type": "string"}},
+            "action_required": {"type": "boolean"},
+            "urgency": {"type": "string", "enum": ["low", "medium", "high"]},
+            "category": {"type": "string", "enum": ["urgent", "meeting", "work", "personal", "spam", "other"]},
+            "action_items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["action", "deadline", "priority"],
+                    "properties": {
+                        "action": {"type": "string"},
+                        "deadline": {"type": "string"},
+                        "priority": {"type": "string", "enum": ["low", "medium", "high"]}
+                    }
+                }
+            },
+            "context_notes": {"type": "string"}
+        }
+    }
+}
+
+CATEGORIZE_INSTRUCTIONS = """Categorize the email you are given.
+
+Choose the most appropriate category:
+- urgent: requires immediate attention
+- meeting: meeting request or scheduling
+- work: work-related but not urgent
+- personal: personal communication
+- spam: likely spam or promotional
+- other: doesn't fit other categories"""
+
+CATEGORY_SCHEMA = {
+    "name": "email_category",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["category"],
+        "properties": {
+            "category": {"type": "string", "enum": ["urgent", "meeting", "work", "personal", "spam", "other"]}
+        }
+    }
+}
+
+_SUMMARY_KEYS = ("summary", "key_points", "action_required", "urgency", "category")
+
+_AFFIRMATIVE = frozenset({"sí", "si", "yes", "true", "1"})
+
+# Plain-text summary labels (Spanish or English) -> the EmailSummary / FULL_ANALYSIS_SCHEMA enums
+_URGENCY_VALUES = {"baja": "low", "media": "medium", "alta": "high", "low": "low", "medium": "medium", "high": "high"}
+_CATEGORY_VALUES = {
+    "trabajo": "work", "personal": "personal", "urgente": "urgent", "reunión": "meeting", "reunion": "meeting",
+    "otro": "other", "spam": "spam", "work": "work", "urgent": "urgent", "meeting": "meeting", "other": "other"
+}
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() in _AFFIRMATIVE
+
+def _parse_urgency(value: str) -> str:
+    return _URGENCY_VALUES.get(value.lower(), "low")
+
+def _parse_category(value: str) -> str:
+    return _CATEGORY_VALUES.get(value.lower(), "other")
+
+# Lowercased label -> (summary field, value converter); a None field starts the key points list
+_SUMMARY_FIELDS = {
+    "resumen": ("summary", str),
+    "summary": ("summary", str),
+    "puntos clave": (None, None),
+    "key points": (None, None),
+    "acción requerida": ("action_required", _parse_bool),
+    "action required": ("action_required", _parse_bool),
+    "urgencia": ("urgency", _parse_urgency),
+    "urgency": ("urgency", _parse_urgency),
+    "categoría": ("category", _parse_category),
+    "category": ("category", _parse_category),
+}
+
+def _new_summary() -> Dict[str, Any]:
+    return {
+        "summary": "",
+        "key_points": [],
+        "action_required": False,
+        "urgency": "low",
+        "category": "other"
+    }
+
+def _parse_summary_line(summary_data: Dict[str, Any], line: str, in_key_points: bool) -> bool:
+    """Apply one line of plain-text summary output to summary_data; returns whether key points are being read"""
+    line = line.strip()
+    if not line:
+        return in_key_points
     
-    def parse(self, text: str) -> Dict[str, Any]:
-        """Parse the LLM output into structured data"""
-        try:
-            # Try to parse as JSON first (fallback for old format)
-            if text.strip().startswith('{'):
-                return json.loads(text)
-            
-            # Parse the new plain text format
-            lines = text.strip().split('\n')
-            summary_data = {
-                "summary": "",
-                "key_points": [],
-                "action_required": False,
-                "urgency": "low",
-                "category": "general"
-            }
-            
-            current_section = None
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # Handle Spanish format
-                if line.lower().startswith("resumen:"):
-                    summary_data["summary"] = line[8:].strip()
-                elif line.lower().startswith("puntos clave:"):
-                    current_section = "key_points"
-                elif line.lower().startswith("acción requerida:"):
-                    action_text = line[17:].strip().lower()
-                    summary_data["action_required"] = action_text in ["sí", "si", "yes", "true", "1"]
-                elif line.lower().startswith("urgencia:"):
-                    summary_data["urgency"] = line[9:].strip().lower()
-                elif line.lower().startswith("categoría:"):
-                    summary_data["category"] = line[10:].strip().lower()
-                elif current_section == "key_points" and line.startswith("-"):
-                    summary_data["key_points"].append(line[1:].strip())
-                # Fallback for English format
-                elif line.lower().startswith("summary:"):
-                    summary_data["summary"] = line[8:].strip()
-                elif line.lower().startswith("key points:"):
-                    current_section = "key_points"
-                elif line.lower().startswith("action required:"):
-                    summary_data["action_required"] = line[15:].strip().lower() in ["yes", "true", "1"]
-                elif line.lower().startswith("urgency:"):
-                    summary_data["urgency"] = line[8:].strip().lower()
-                elif line.lower().startswith("category:"):
-                    summary_data["category"] = line[9:].strip().lower()
-            
-            return summary_data
-            
-        except Exception as e:
-            logger.error(f"Error parsing summary output: {str(e)}")
-            return {
-                "summary": text,
-                "key_points": [],
-                "action_required": False,
-                "urgency": "low",
-                "category": "general"
-            }
+    label, sep, value = line.partition(":")
+    field = _SUMMARY_FIELDS.get(label.strip().lower()) if sep else None
+    if field is not None:
+        key, convert = field
+        if key is None:
+            return True
+        summary_data[key] = convert(value.strip())
+    elif in_key_points and line.startswith("-"):
+        summary_data["key_points"].append(line[1:].strip())
+    return in_key_points
+
+def _parse_summary_output(text: str) -> Dict[str, Any]:
+    """Parse a summary answer, structured (FULL_ANALYSIS_SCHEMA) or plain text, into the summary fields"""
+    try:
+        # Structured answers only need their summary fields
+        if text.strip().startswith('{'):
+            analysis = orjson.loads(text)
+            return {key: analysis[key] for key in _SUMMARY_KEYS}
+        
+        # Parse the plain text format: one "Label: value" field per line, dispatched on the label
+        summary_data = _new_summary()
+        in_key_points = False
+        for line in text.strip().split('\n'):
+            in_key_points = _parse_summary_line(summary_data, line, in_key_points)
+        
+        return summary_data
+        
+    except Exception as e:
+        logger.error(f"Error parsing summary output: {str(e)}")
+        return {
+            "summary": text,
+            "key_points": [],
+            "action_required": False,
+            "urgency": "low",
+            "category": "other"
+        }
+
+if LANGCHAIN_AVAILABLE:
+    class EmailSummaryOutputParser(BaseOutputParser):
+        """Custom parser for email summary output, for use in LangChain chains"""
+        
+        def parse(self, text: str) -> Dict[str, Any]:
+            """Parse the LLM output into structured data"""
+            return _parse_summary_output(text)
 
 class EmailSummarizer:
     def __init__(self):
-        self.llm = None
-        self.summary_chain = None
-        self.analysis_chain = None
+        self.client = None
+        self.total_tokens = 0
+        self._inflight: Dict[str, asyncio.Future] = {}  # cache key -> analysis request in progress
+        self.llm_cache = LLMCache(redis_url=os.getenv("REDIS_URL"))
         
-        if LANGCHAIN_AVAILABLE:
+        if OPENAI_AVAILABLE:
             self._initialize_llm()
     
     def get_status(self) -> Dict[str, Any]:
         """Get the status of the summarizer"""
         return {
-            "available": LANGCHAIN_AVAILABLE,
-            "initialized": self.llm is not None,
-            "api_key_set": bool(os.getenv("OPENAI_API_KEY"))
+            "available": OPENAI_AVAILABLE,
+            "initialized": self.client is not None,
+            "api_key_set": bool(os.getenv("OPENAI_API_KEY")),
+            "llm_cache": self.llm_cache.get_status(),
+            "total_tokens": self.total_tokens
         }
     
     def _initialize_llm(self):
@@ -110,81 +245,13 @@ class EmailSummarizer:
                 logger.warning("OPENAI_API_KEY not set")
                 return
             
-            self.llm = OpenAI(
-                temperature=0.3,
-                max_tokens=500,
-                openai_api_key=api_key
-            )
-            
-            # Create summary prompt template
-            summary_template = """
-            Analiza el siguiente correo electrónico y proporciona un resumen estructurado en español:
-            
-            De: {sender}
-            Asunto: {subject}
-            Fecha: {date}
-            
-            Contenido del correo:
-            {body}
-            
-            Proporciona tu respuesta en el siguiente formato:
-            
-            Resumen: [Resumen breve del contenido del correo en español]
-            
-            Puntos clave:
-            - [Punto 1]
-            - [Punto 2]
-            - [Punto 3]
-            
-            Acción requerida: [Sí/No]
-            Urgencia: [baja/media/alta]
-            Categoría: [trabajo/personal/urgente/reunión/otro]
-            """
-            
-            summary_prompt = PromptTemplate(
-                input_variables=["sender", "subject", "date", "body"],
-                template=summary_template
-            )
-            
-            self.summary_chain = LLMChain(
-                llm=self.llm,
-                prompt=summary_prompt,
-                output_parser=EmailSummaryOutputParser()
-            )
-            
-            # Create analysis prompt template
-            analysis_template = """
-            Analiza este correo electrónico para obtener detalles importantes y contexto:
-            
-            De: {sender}
-            Asunto: {subject}
-            Contenido: {body}
-            
-            Proporciona información sobre:
-            1. La intención y tono del remitente
-            2. Cualquier fecha límite o información sensible al tiempo
-            3. Acciones o respuestas requeridas
-            4. Contexto de la relación (profesional, personal, etc.)
-            5. Cualquier archivo adjunto o contexto adicional necesario
-            
-            Mantén el análisis conciso pero completo. Responde en español.
-            """
-            
-            analysis_prompt = PromptTemplate(
-                input_variables=["sender", "subject", "body"],
-                template=analysis_template
-            )
-            
-            self.analysis_chain = LLMChain(
-                llm=self.llm,
-                prompt=analysis_prompt
-            )
+            self.client = AsyncOpenAI(api_key=api_key, max_retries=LLM_MAX_RETRIES)
             
             logger.info("Email summarizer initialized successfully")
             
         except Exception as e:
             logger.error(f"Error initializing summarizer: {str(e)}")
-            self.llm = None
+            self.client = None
     
     async def summarize_email(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -196,56 +263,256 @@ class EmailSummarizer:
         Returns:
             Structured summary of the email
         """
-        if not self.summary_chain:
+        if not self.client:
             return {
                 "summary": "AI summarization not available",
                 "key_points": [],
                 "action_required": False,
                 "urgency": "low",
-                "category": "general",
+                "category": "other",
                 "error": "Summarizer not initialized"
             }
         
-        try:
-            # Extract email information
-            sender = email_data.get("sender", "Unknown")
-            subject = email_data.get("subject", "No subject")
-            date = email_data.get("date", "Unknown date")
-            body = email_data.get("body", "")
-            
-            # Truncate body if too long
-            if len(body) > 3000:
-                body = body[:3000] + "..."
-            
-            # Generate summary
-            with get_openai_callback() as cb:
-                result = self.summary_chain.run(
-                    sender=sender,
-                    subject=subject,
-                    date=date,
-                    body=body
-                )
-                
-                logger.info(f"Summary generated - Tokens used: {cb.total_tokens}")
-            
-            # Add metadata
-            result["email_id"] = email_data.get("id")
-            result["original_sender"] = sender
-            result["original_subject"] = subject
-            result["original_date"] = date
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error summarizing email: {str(e)}")
+        analysis = await self.analyze_full(email_data)
+        if "error" in analysis:
             return {
-                "summary": f"Error summarizing email: {str(e)}",
+                "summary": f"Error summarizing email: {analysis['error']}",
                 "key_points": [],
                 "action_required": False,
                 "urgency": "low",
-                "category": "general",
-                "error": str(e)
+                "category": "other",
+                "error": analysis["error"]
             }
+        
+        result = {key: analysis[key] for key in _SUMMARY_KEYS}
+        return self._add_summary_metadata(result, email_data, self._summary_fields(email_data))
+    
+    async def summarize_email_stream(self, email_data: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a summary for interactive callers, updating it as each output line completes
+        
+        Args:
+            email_data: Email data from Gmail integration
+        
+        Yields:
+            A snapshot of the partial summary after each completed line; the last one includes
+            the email metadata
+        """
+        if not self.client:
+            yield await self.summarize_email(email_data)
+            return
+        
+        fields = self._summary_fields(email_data)
+        summary_data = _new_summary()
+        in_key_points = False
+        buffer = ""
+        
+        try:
+            # The LLM slot is held while the model streams, not while our consumer reads
+            async for text in limited_stream(self._stream_summary_text(fields)):
+                buffer += text
+                
+                # Dispatch each completed line through the summary parser
+                *lines, buffer = buffer.split("\n")
+                if lines:
+                    for line in lines:
+                        in_key_points = _parse_summary_line(summary_data, line, in_key_points)
+                    yield dict(summary_data, key_points=list(summary_data["key_points"]))
+            
+            _parse_summary_line(summary_data, buffer, in_key_points)
+            yield self._add_summary_metadata(summary_data, email_data, fields)
+        
+        except Exception as e:
+            logger.error(f"Error streaming summary: {str(e)}")
+            summary_data["error"] = str(e)
+            yield summary_data
+    
+    async def _stream_summary_text(self, fields: Dict[str, str]) -> AsyncIterator[str]:
+        """Stream the plain-text summary output for an email"""
+        stream = await self.client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            temperature=0.3,
+            max_tokens=500,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": SUMMARY_EMAIL_TEMPLATE.format(**fields)}
+            ],
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def analyze_full(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Summarize, categorize, extract action items and note context for an email in one LLM call
+        
+        Args:
+            email_data: Email data from Gmail integration
+        
+        Returns:
+            Dict with summary, key_points, action_required, urgency, category, action_items
+            and context_notes, or with an "error" key if the analysis failed
+        """
+        if not self.client:
+            return {"error": "Summarizer not initialized"}
+        
+        try:
+            email_text = self._email_text(email_data)
+            
+            # Temperature 0 makes the answer a pure function of the prompt, so repeats
+            # (e.g. mailing-list traffic) are served from the LLM cache
+            cache_key = LLMCache.make_key(SUMMARY_MODEL, FULL_ANALYSIS_INSTRUCTIONS, email_text)
+            content = await self.llm_cache.get(cache_key)
+            if content is None:
+                # Concurrent summarize/categorize/action-item calls for one email share a single request
+                pending = self._inflight.get(cache_key)
+                if pending is None:
+                    pending = asyncio.ensure_future(self._request_analysis(cache_key, email_text))
+                    self._inflight[cache_key] = pending
+                    pending.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+                content = await asyncio.shield(pending)
+            
+            return orjson.loads(content)
+        
+        except Exception as e:
+            logger.error(f"Error analyzing email: {str(e)}")
+            return {"error": str(e)}
+    
+    async def _request_analysis(self, cache_key: str, email_text: str) -> str:
+        """Call the model for a full analysis and store the JSON answer in the LLM cache"""
+        async with llm_semaphore:
+            response = await self.client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                temperature=0,
+                max_tokens=800,
+                messages=[
+                    {"role": "system", "content": FULL_ANALYSIS_INSTRUCTIONS},
+                    {"role": "user", "content": email_text}
+                ],
+                response_format={"type": "json_schema", "json_schema": FULL_ANALYSIS_SCHEMA}
+            )
+        content = response.choices[0].message.content
+        if response.usage:
+            self.total_tokens += response.usage.total_tokens
+            logger.info(f"Email analyzed - Tokens used: {response.usage.total_tokens}")
+        await self.llm_cache.set(cache_key, content)
+        return content
+    
+    async def summarize_many(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Summarize emails concurrently, up to OPENAI_MAX_CONCURRENCY requests in flight
+        
+        Args:
+            emails: Email data from Gmail integration
+        
+        Returns:
+            Structured summaries, in input order
+        """
+        return list(await asyncio.gather(*(self.summarize_email(email_data) for email_data in emails)))
+    
+    async def bulk_summarize(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Summarize many emails, through the OpenAI Batch API for large non-interactive runs
+        
+        Args:
+            emails: Email data from Gmail integration
+        
+        Returns:
+            Structured summaries, in input order
+        """
+        if len(emails) < BULK_BATCH_MIN_EMAILS or not self.client:
+            return await self.summarize_many(emails)
+        
+        try:
+            fields = [self._summary_fields(email_data) for email_data in emails]
+            prompts = [SUMMARY_EMAIL_TEMPLATE.format(**email_fields) for email_fields in fields]
+            
+            # One full analysis request per email (as in analyze_full), matched back by its index in custom_id
+            requests = b"\n".join(
+                orjson.dumps({
+                    "custom_id": str(index),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": SUMMARY_MODEL,
+                        "temperature": 0,
+                        "max_tokens": 800,
+                        "messages": [
+                            {"role": "system", "content": FULL_ANALYSIS_INSTRUCTIONS},
+                            {"role": "user", "content": prompt}
+                        ],
+                        "response_format": {"type": "json_schema", "json_schema": FULL_ANALYSIS_SCHEMA}
+                    }
+                })
+                for index, prompt in enumerate(prompts)
+            )
+            
+            input_file = await self.client.files.create(file=("summaries.jsonl", requests), purpose="batch")
+            batch = await self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            logger.info(f"Submitted summary batch {batch.id} with {len(emails)} emails")
+            
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                await asyncio.sleep(BULK_POLL_SECONDS)
+                batch = await self.client.batches.retrieve(batch.id)
+            
+            results: List[Optional[Dict[str, Any]]] = [None] * len(emails)
+            if batch.output_file_id:
+                output = await self.client.files.content(batch.output_file_id)
+                for line in output.text.splitlines():
+                    if not line:
+                        continue
+                    item = orjson.loads(line)
+                    choices = ((item.get("response") or {}).get("body") or {}).get("choices")
+                    if choices:
+                        index = int(item["custom_id"])
+                        content = choices[0]["message"]["content"]
+                        summary = _parse_summary_output(content)
+                        results[index] = self._add_summary_metadata(summary, emails[index], fields[index])
+                        
+                        # Same request as analyze_full, so later single-email calls reuse the answer
+                        await self.llm_cache.set(LLMCache.make_key(SUMMARY_MODEL, FULL_ANALYSIS_INSTRUCTIONS, prompts[index]), content)
+            
+            # Emails the batch didn't return (request errors, expiry) are summarized directly
+            missing = [index for index, result in enumerate(results) if result is None]
+            if missing:
+                logger.warning(f"Summary batch {batch.id} ended '{batch.status}' without {len(missing)} emails, summarizing them directly")
+                fallback = await self.summarize_many([emails[index] for index in missing])
+                for index, result in zip(missing, fallback):
+                    results[index] = result
+            
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error running summary batch: {str(e)}")
+            return await self.summarize_many(emails)
+    
+    @staticmethod
+    def _summary_fields(email_data: Dict[str, Any]) -> Dict[str, str]:
+        """Extract the summary prompt fields from an email, truncating long bodies"""
+        return {
+            "sender": email_data.get("sender", "Unknown"),
+            "subject": email_data.get("subject", "No subject"),
+            "date": email_data.get("date", "Unknown date"),
+            "body": truncate_to_tokens(email_data.get("body", ""), MAX_BODY_TOKENS)
+        }
+    
+    def _email_text(self, email_data: Dict[str, Any]) -> str:
+        """Render the per-email user message shared by the analysis and categorization prompts"""
+        return SUMMARY_EMAIL_TEMPLATE.format(**self._summary_fields(email_data))
+    
+    @staticmethod
+    def _add_summary_metadata(result: Dict[str, Any], email_data: Dict[str, Any], fields: Dict[str, str]) -> Dict[str, Any]:
+        """Attach the original email's identifiers to a summary"""
+        result["email_id"] = email_data.get("id")
+        result["original_sender"] = fields["sender"]
+        result["original_subject"] = fields["subject"]
+        result["original_date"] = fields["date"]
+        return result
     
     async def analyze_email_context(self, email_data: Dict[str, Any]) -> str:
         """
@@ -257,29 +524,14 @@ class EmailSummarizer:
         Returns:
             Analysis text
         """
-        if not self.analysis_chain:
+        if not self.client:
             return "AI analysis not available"
         
-        try:
-            sender = email_data.get("sender", "Unknown")
-            subject = email_data.get("subject", "No subject")
-            body = email_data.get("body", "")
-            
-            # Truncate body if too long
-            if len(body) > 2000:
-                body = body[:2000] + "..."
-            
-            result = self.analysis_chain.run(
-                sender=sender,
-                subject=subject,
-                body=body
-            )
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error analyzing email: {str(e)}")
-            return f"Error analyzing email: {str(e)}"
+        analysis = await self.analyze_full(email_data)
+        if "error" in analysis:
+            return f"Error analyzing email: {analysis['error']}"
+        
+        return analysis["context_notes"]
     
     async def extract_action_items(self, email_data: Dict[str, Any]) -> list:
         """
@@ -291,40 +543,11 @@ class EmailSummarizer:
         Returns:
             List of action items
         """
-        if not self.llm:
+        if not self.client:
             return []
         
-        try:
-            prompt = f"""
-            Extract specific action items from this email:
-            
-            From: {email_data.get('sender', 'Unknown')}
-            Subject: {email_data.get('subject', 'No subject')}
-            Content: {email_data.get('body', '')[:1000]}
-            
-            Return a JSON array of action items, each with:
-            - action: description of what needs to be done
-            - deadline: when it needs to be done (if mentioned)
-            - priority: low/medium/high
-            
-            Example: [{{"action": "Review proposal", "deadline": "Friday", "priority": "high"}}]
-            """
-            
-            response = self.llm(prompt)
-            
-            # Try to parse as JSON
-            try:
-                action_items = json.loads(response)
-                return action_items if isinstance(action_items, list) else []
-            except json.JSONDecodeError:
-                # If not JSON, return a simple list
-                lines = response.strip().split('\n')
-                return [{"action": line.strip(), "deadline": "", "priority": "medium"} 
-                       for line in lines if line.strip()]
-            
-        except Exception as e:
-            logger.error(f"Error extracting action items: {str(e)}")
-            return []
+        analysis = await self.analyze_full(email_data)
+        return analysis.get("action_items", [])
     
     async def categorize_email(self, email_data: Dict[str, Any]) -> str:
         """
@@ -336,34 +559,41 @@ class EmailSummarizer:
         Returns:
             Category string
         """
-        if not self.llm:
-            return "general"
+        if not self.client:
+            return "other"
         
         try:
-            prompt = f"""
-            Categorize this email:
-            
-            From: {email_data.get('sender', 'Unknown')}
-            Subject: {email_data.get('subject', 'No subject')}
-            Content: {email_data.get('body', '')[:500]}
-            
-            Choose the most appropriate category:
-            - urgent: requires immediate attention
-            - meeting: meeting request or scheduling
-            - work: work-related but not urgent
-            - personal: personal communication
-            - spam: likely spam or promotional
-            - other: doesn't fit other categories
-            
-            Return only the category name.
-            """
-            
-            response = self.llm(prompt)
-            category = response.strip().lower()
-            
-            valid_categories = ["urgent", "meeting", "work", "personal", "spam", "other"]
-            return category if category in valid_categories else "other"
-            
+            email_text = self._email_text(email_data)
+            
+            # Reuse a full analysis of this email if one is cached or already in flight
+            analysis_key = LLMCache.make_key(SUMMARY_MODEL, FULL_ANALYSIS_INSTRUCTIONS, email_text)
+            pending = self._inflight.get(analysis_key)
+            content = await asyncio.shield(pending) if pending else await self.llm_cache.peek(analysis_key)
+            if content is not None:
+                return orjson.loads(content)["category"]
+            
+            # Otherwise only the label is needed, so route to the small classifier model
+            cache_key = LLMCache.make_key(CLASSIFIER_MODEL, CATEGORIZE_INSTRUCTIONS, email_text)
+            content = await self.llm_cache.get(cache_key)
+            if content is None:
+                async with llm_semaphore:
+                    response = await self.client.chat.completions.create(
+                        model=CLASSIFIER_MODEL,
+                        temperature=0,
+                        max_tokens=20,
+                        messages=[
+                            {"role": "system", "content": CATEGORIZE_INSTRUCTIONS},
+                            {"role": "user", "content": email_text}
+                        ],
+                        response_format={"type": "json_schema", "json_schema": CATEGORY_SCHEMA}
+                    )
+                content = response.choices[0].message.content
+                if response.usage:
+                    self.total_tokens += response.usage.total_tokens
+                await self.llm_cache.set(cache_key, content)
+            
+            return orjson.loads(content)["category"]
+        
         except Exception as e:
             logger.error(f"Error categorizing email: {str(e)}")
             return "other"
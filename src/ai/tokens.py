@@ -0,0 +1,26 @@
+"""
+Token Budget Helpers
+Trims prompt text to a model-token budget, shared by the summarizer and responder
+"""
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+_encoding = None
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to max_tokens model tokens (approximated as ~4 characters per token without tiktoken)"""
+    global _encoding
+    if not TIKTOKEN_AVAILABLE:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars] + "..."
+    
+    if _encoding is None:
+        _encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+    tokens = _encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding.decode(tokens[:max_tokens]) + "..."
@@ -5,29 +5,59 @@ Handles approval workflows and user interactions
 
 import logging
 import os
-from typing import Dict, Any, Optional, List
+import re
+import time
+import heapq
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, timedelta
-import json
 import uuid
+from types import MappingProxyType
+import orjson
+
+from src.persistence import DebouncedWriter
 
 logger = logging.getLogger(__name__)
 
+CONFIG_FILE = "hitl_config.json"
+CONFIG_SAVE_DELAY = 0.2  # Seconds to coalesce config changes before one write
+
+# "approve 12345", "reject abc-def", "action 12345" or "#12345"
+_ACTION_ID_RE = re.compile(r'(?:approve|reject|yes|no|action)\s+([a-f0-9-]{8,})|#([a-f0-9-]{8,})', re.IGNORECASE)
+
+# Whole-word approval/rejection replies (emoji count as their own token)
+_APPROVE_TOKENS = frozenset({"✅", "yes", "y", "approve", "ok", "sí", "si", "confirm"})
+_REJECT_TOKENS = frozenset({"❌", "no", "n", "reject", "cancel"})
+_TOKEN_RE = re.compile(r'\w+|[✅❌]')
+
+def _compile_patterns(patterns: List[str]) -> Optional[re.Pattern]:
+    """Compile user patterns into one case-insensitive substring alternation"""
+    if not patterns:
+        return None
+    return re.compile("|".join(re.escape(pattern) for pattern in patterns), re.IGNORECASE)
+
 class PendingAction:
     """Represents a pending action waiting for user approval"""
     
+    __slots__ = ("id", "action_type", "data", "created_at", "expires_at", "_created", "_expires",
+                 "status", "user_response", "response_at")
+    
     def __init__(self, action_type: str, data: Dict[str, Any], expires_in_minutes: int = 30):
         self.id = str(uuid.uuid4())
         self.action_type = action_type
-        self.data = data
+        # Read-only view over a private copy, so callers can't change an action after creation
+        self.data = MappingProxyType(dict(data))
         self.created_at = datetime.now()
         self.expires_at = self.created_at + timedelta(minutes=expires_in_minutes)
+        # Monotonic copies for expiry checks and ordering; the datetimes are only for display
+        self._created = time.monotonic()
+        self._expires = self._created + expires_in_minutes * 60
         self.status = "pending"  # pending, approved, rejected, expired
         self.user_response = None
         self.response_at = None
     
     def is_expired(self) -> bool:
         """Check if the action has expired"""
-        return datetime.now() > self.expires_at
+        return time.monotonic() > self._expires
     
     def approve(self, user_response: str = None) -> bool:
         """Approve the action"""
@@ -54,7 +84,7 @@ class PendingAction:
         return {
             "id": self.id,
             "action_type": self.action_type,
-            "data": self.data,
+            "data": dict(self.data),
             "created_at": self.created_at.isoformat(),
             "expires_at": self.expires_at.isoformat(),
             "status": self.status,
@@ -67,10 +97,15 @@ class HITLManager:
     """Manages human-in-the-loop workflows and approvals"""
     
     def __init__(self):
-        self.pending_actions: Dict[str, PendingAction] = {}
+        self.pending_actions: Dict[str, PendingAction] = {}  # Insertion-ordered, so newest is last
+        self._expiry_heap: List[Tuple[float, str]] = []  # (monotonic expiry, action id)
+        self._snapshots: Dict[Optional[str], List[Dict[str, Any]]] = {}  # status filter -> serialized actions
         self.user_phone = None  # Will be set from environment or config
         self.auto_approve_patterns = []  # Patterns for auto-approval
         self.auto_reject_patterns = []  # Patterns for auto-rejection
+        self._auto_approve_re = None  # Compiled from auto_approve_patterns
+        self._auto_reject_re = None  # Compiled from auto_reject_patterns
+        self._config_writer = DebouncedWriter(CONFIG_FILE, self._config_payload, CONFIG_SAVE_DELAY)
         
         self._load_config()
     
@@ -83,15 +118,23 @@ class HITLManager:
             "auto_reject_patterns": len(self.auto_reject_patterns)
         }
     
+    def start(self):
+        """Start the background config writer (must be called with a running event loop)"""
+        self._config_writer.start()
+    
+    async def stop(self):
+        """Stop the background config writer, flushing any unsaved change"""
+        await self._config_writer.stop()
+    
     def _load_config(self):
         """Load HITL configuration"""
         try:
-            config_file = "hitl_config.json"
-            if os.path.exists(config_file):
-                with open(config_file, 'r') as f:
-                    config = json.load(f)
+            if os.path.exists(CONFIG_FILE):
+                with open(CONFIG_FILE, 'rb') as f:
+                    config = orjson.loads(f.read())
                     self.auto_approve_patterns = config.get("auto_approve_patterns", [])
                     self.auto_reject_patterns = config.get("auto_reject_patterns", [])
+            self._compile_auto_patterns()
         except Exception as e:
             logger.error(f"Error loading HITL config: {str(e)}")
     
@@ -110,6 +153,8 @@ class HITLManager:
         """
         action = PendingAction(action_type, data, expires_in_minutes)
         self.pending_actions[action.id] = action
+        heapq.heappush(self._expiry_heap, (action._expires, action.id))
+        self._snapshots.clear()
         
         logger.info(f"Created pending action: {action.id} ({action_type})")
         return action
@@ -118,15 +163,6 @@ class HITLManager:
         """Get a pending action by ID"""
         return self.pending_actions.get(action_id)
     
-    def get_pending_actions(self) -> List[PendingAction]:
-        """Get all pending actions"""
-        # Clean up expired actions first
-        self._cleanup_expired_actions()
-        
-        # Return only non-expired pending actions
-        return [action for action in self.pending_actions.values() 
-                if action.status == "pending" and not action.is_expired()]
-    
     def process_user_response(self, message: str, from_phone: str) -> Optional[Dict[str, Any]]:
         """
         Process a user response to a pending action
@@ -155,59 +191,37 @@ class HITLManager:
     
     def _extract_action_id(self, message: str) -> Optional[str]:
         """Extract action ID from message (if user references a specific action)"""
-        # Look for patterns like "approve 12345" or "reject abc-def"
-        import re
-        patterns = [
-            r'(?:approve|reject|yes|no)\s+([a-f0-9-]{8,})',
-            r'action\s+([a-f0-9-]{8,})',
-            r'#([a-f0-9-]{8,})'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, message, re.IGNORECASE)
-            if match:
-                return match.group(1)
+        match = _ACTION_ID_RE.search(message)
+        if match:
+            return match.group(1) or match.group(2)
         
         return None
     
     def _check_approval_patterns(self, message: str) -> Optional[str]:
         """Check if message matches approval/rejection patterns"""
-        message_lower = message.lower().strip()
-        
-        # Check auto-approve patterns
-        for pattern in self.auto_approve_patterns:
-            if pattern.lower() in message_lower:
-                return "approve"
-        
-        # Check auto-reject patterns
-        for pattern in self.auto_reject_patterns:
-            if pattern.lower() in message_lower:
-                return "reject"
-        
-        # Check common approval/rejection patterns
-        approval_words = ["✅", "yes", "y", "approve", "ok", "sí", "si", "confirm"]
-        rejection_words = ["❌", "no", "n", "reject", "cancel", "no"]
+        # Check auto-approve/auto-reject patterns
+        if self._auto_approve_re and self._auto_approve_re.search(message):
+            return "approve"
+        if self._auto_reject_re and self._auto_reject_re.search(message):
+            return "reject"
         
-        if any(word in message_lower for word in approval_words):
+        # Check common approval/rejection words, tokenizing the message once
+        tokens = set(_TOKEN_RE.findall(message.lower()))
+        if not _APPROVE_TOKENS.isdisjoint(tokens):
             return "approve"
-        elif any(word in message_lower for word in rejection_words):
+        elif not _REJECT_TOKENS.isdisjoint(tokens):
             return "reject"
         
         return None
     
     def _get_most_recent_pending_action(self) -> Optional[PendingAction]:
         """Get the most recent pending action"""
-        if not self.pending_actions:
-            return None
-        
-        # Return the most recently created action that's still pending
-        pending_actions = [action for action in self.pending_actions.values() 
-                          if action.status == "pending" and not action.is_expired()]
+        # Walk back from the newest action to the first one still pending
+        for action in reversed(self.pending_actions.values()):
+            if action.status == "pending" and not action.is_expired():
+                return action
         
-        if not pending_actions:
-            return None
-        
-        return max(pending_actions, key=lambda x: x.created_at)
+        return None
     
     def _handle_action_response(self, action_id: str, message: str) -> Dict[str, Any]:
         """Handle a response to a specific action"""
@@ -224,17 +238,19 @@ class HITLManager:
         if approval_status == "approve":
             success = action.approve(message)
             if success:
+                self._snapshots.clear()
                 logger.info(f"Action {action_id} approved")
                 return {
                     "success": True,
                     "action_id": action_id,
                     "status": "approved",
                     "action_type": action.action_type,
-                    "data": action.data
+                    "data": dict(action.data)
                 }
         elif approval_status == "reject":
             success = action.reject(message)
             if success:
+                self._snapshots.clear()
                 logger.info(f"Action {action_id} rejected")
                 return {
                     "success": True,
@@ -245,27 +261,47 @@ class HITLManager:
         
         return {"success": False, "error": "Could not determine approval status"}
     
-    def get_pending_actions(self, status: str = None) -> List[Dict[str, Any]]:
-        """Get all pending actions, optionally filtered by status"""
-        actions = list(self.pending_actions.values())
+    def get_pending_actions(self, status: Optional[str] = "pending") -> List[Dict[str, Any]]:
+        """
+        Get unexpired actions, filtered by status
+        
+        Args:
+            status: Status to keep (pending, approved, rejected), or None for all
+            
+        Returns:
+            Serialized actions (a shared snapshot - don't mutate it)
+        """
+        # Clean up expired actions first (drops the snapshots if anything expired)
+        self.cleanup_expired_actions()
         
+        # Serve repeated polls from the snapshot until an action is created, answered or expires
+        snapshot = self._snapshots.get(status)
+        if snapshot is not None:
+            return snapshot
+        
+        actions = self.pending_actions.values()
         if status:
             actions = [action for action in actions if action.status == status]
         
-        return [action.to_dict() for action in actions]
+        snapshot = [action.to_dict() for action in actions]
+        self._snapshots[status] = snapshot
+        return snapshot
     
     def cleanup_expired_actions(self) -> int:
         """Remove expired actions and return count of cleaned actions"""
-        expired_actions = [action_id for action_id, action in self.pending_actions.items() 
-                          if action.is_expired()]
-        
-        for action_id in expired_actions:
-            del self.pending_actions[action_id]
+        # Pop only the heap entries whose expiry has passed
+        now = time.monotonic()
+        cleaned = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            _, action_id = heapq.heappop(self._expiry_heap)
+            if self.pending_actions.pop(action_id, None) is not None:
+                cleaned += 1
         
-        if expired_actions:
-            logger.info(f"Cleaned up {len(expired_actions)} expired actions")
+        if cleaned:
+            self._snapshots.clear()
+            logger.info(f"Cleaned up {cleaned} expired actions")
         
-        return len(expired_actions)
+        return cleaned
     
     def get_action_summary(self, action_id: str) -> Optional[str]:
         """Get a human-readable summary of an action"""
@@ -285,6 +321,7 @@ class HITLManager:
         try:
             if pattern not in self.auto_approve_patterns:
                 self.auto_approve_patterns.append(pattern)
+                self._compile_auto_patterns()
                 self._save_config()
                 return True
             return False
@@ -297,6 +334,7 @@ class HITLManager:
         try:
             if pattern not in self.auto_reject_patterns:
                 self.auto_reject_patterns.append(pattern)
+                self._compile_auto_patterns()
                 self._save_config()
                 return True
             return False
@@ -304,16 +342,19 @@ class HITLManager:
             logger.error(f"Error adding auto-reject pattern: {str(e)}")
             return False
     
+    def _compile_auto_patterns(self):
+        """Rebuild the compiled auto-approve/auto-reject matchers"""
+        self._auto_approve_re = _compile_patterns(self.auto_approve_patterns)
+        self._auto_reject_re = _compile_patterns(self.auto_reject_patterns)
+    
     def _save_config(self):
-        """Save HITL configuration"""
-        try:
-            config = {
-                "auto_approve_patterns": self.auto_approve_patterns,
-                "auto_reject_patterns": self.auto_reject_patterns
-            }
-            
-            with open("hitl_config.json", 'w') as f:
-                json.dump(config, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving HITL config: {str(e)}")
-
+        """Save HITL configuration, coalesced on the background writer when it is running"""
+        self._config_writer.save()
+    
+    def _config_payload(self) -> bytes:
+        """Serialize the persisted part of the configuration"""
+        config = {
+            "auto_approve_patterns": self.auto_approve_patterns,
+            "auto_reject_patterns": self.auto_reject_patterns
+        }
+        return orjson.dumps(config, option=orjson.OPT_INDENT_2)
@@ -0,0 +1,36 @@
+"""
+ASGI Middleware
+Pure ASGI middlewares (no BaseHTTPMiddleware / @app.middleware("http") wrappers)
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class AccessLogMiddleware:
+    """Logs method, path, status and duration of each HTTP request"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if logger.isEnabledFor(logging.INFO):
+                duration_ms = (time.perf_counter() - start) * 1000
+                logger.info("%s %s %d %.1fms", scope["method"], scope["path"], status_code, duration_ms)
@@ -3,21 +3,71 @@ Main Message Router
 Handles message flow and coordinates all integrations
 """
 
+import os
+import re
+import time
 import logging
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
 import asyncio
+import orjson
 
 from src.integrations.whatsapp import WhatsAppIntegration
 # from src.integrations.gmail import GmailIntegration
 from src.integrations.calendar import CalendarIntegration
 from src.core.hitl import HITLManager
+from src.persistence import DebouncedWriter
 # from src.ai.summarizer import EmailSummarizer
 # from src.ai.responder import EmailResponder
 from src.ai.conversation import ConversationAI
 
 logger = logging.getLogger(__name__)
 
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Queued messages (across all workers) before webhooks are refused
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "4")))  # Concurrent message handlers, each owning a queue shard
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))  # Seconds to finish queued messages on shutdown
+MAX_PROCESSED_MESSAGES = 1000  # Recent message IDs remembered for duplicate detection
+SENT_EMAILS_FILE = "data/sent_emails.json"
+SENT_EMAILS_SAVE_DELAY = 5  # Seconds to coalesce sent email changes before one write
+MAX_SENT_EMAILS = 5000  # Tracked email threads kept, oldest dropped first
+SENT_EMAILS_MAX_AGE = 30 * 86400  # Seconds a tracked thread survives across restarts
+SENDER_STATE_TTL = 3600  # Seconds of inactivity before a phone's rate-limit/loop state is dropped
+SENDER_SWEEP_INTERVAL = 1000  # Messages handled between sweeps of stale per-phone state
+
+# Message filters, compiled once at import and matched against the lowercased message
+_ACK_RE = re.compile(r'\b(?:sent|delivered|read|ok|true)\b')
+_ASSISTANT_RESPONSES = (
+    "¡claro! puedo platicar contigo sobre cualquier tema",
+    "puedo platicar contigo sobre cualquier tema",
+    "lo siento, estoy teniendo problemas para procesar tu mensaje",
+    "entiendo que dijiste",
+    "estoy aquí para ayudarte"
+)
+_ASSISTANT_ECHO_RE = re.compile("|".join(map(re.escape, _ASSISTANT_RESPONSES)))
+_CALENDAR_KEYWORDS_RE = re.compile("|".join(map(re.escape, (
+    "schedule", "meeting", "appointment", "agendar", "programar", "reunión", "cita", "calendario"
+))))
+
+_SKIPPED_EVENT_TYPES = frozenset({"message_ack", "message_create", "message_sent"})
+
+# Replies that may answer a pending HITL action; whole words so "nosotros" isn't a "no"
+_HITL_REPLY_RE = re.compile(r'✅|❌|\b(?:sí|si|no|yes|aprobar|rechazar)\b')
+
+# Command parsing patterns
+_QUOTED_TITLE_RE = re.compile(r'"([^"]+)"')
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})\s*(am|pm)?', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})')
+_MEETING_REQUEST_RE = re.compile(r'preguntando si está disponible para una reunión (.+?)(?:\.|$)')
+# Instruction phrasing stripped from free-form email requests
+_EMAIL_INSTRUCTION_RE = re.compile("|".join((
+    r'envíame un correo a [^ ]+ preguntando',
+    r'send me an email to [^ ]+ asking',
+    r'envía un correo a [^ ]+ preguntando',
+    r'envíame un correo a [^ ]+ diciendo',
+    r'send an email to [^ ]+ saying'
+)), re.IGNORECASE)
+
 class MessageRouter:
     """Main router that coordinates all integrations and handles message flow"""
     
@@ -33,58 +83,99 @@ class MessageRouter:
         # self.responder = EmailResponder(calendar_integration=calendar)
         self.conversation_ai = ConversationAI()
         
+        # Command -> handler(from_phone), looked up once per command message
+        self._command_table = {
+            "/status": self._send_status_message,
+            # "/emails": self._check_and_send_emails,
+            # "/allemails": self._check_and_send_all_emails,
+            "/help": self._send_help_message,
+            "/clear": self._clear_conversation,
+            "/personality": self._show_personality,
+            "/summary": self._show_conversation_summary,
+            "/calendar": self._send_calendar_summary,
+            "/events": self._list_calendar_events,
+            "/create": self._create_calendar_event_prompt,
+            "/delete": self._delete_calendar_event_prompt,
+            "/edit": self._edit_calendar_event_prompt,
+            "/stop": self._emergency_stop_assistant,
+            "/start": self._start_assistant,
+            # "/autoemails": self._toggle_auto_emails,
+        }
+        
         # Configuration
         self.my_phone_number = whatsapp.my_phone_number
         self.auto_check_emails = False  # Disabled to prevent automatic messages
         self.email_check_interval = 60  # 1 minute
         
         # Track sent emails for reply detection
-        self.sent_emails = {}  # thread_id -> email_info
+        self.sent_emails: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # thread_id -> email_info, oldest first
+        self._sent_emails_writer = DebouncedWriter(SENT_EMAILS_FILE, self._sent_emails_payload, SENT_EMAILS_SAVE_DELAY)
         self._load_sent_emails()
         
         # Track recent messages to prevent loops
         self.recent_messages = {}  # phone -> [messages]
+        self._recent_message_times = {}  # phone -> monotonic time of its last recent message
+        self._messages_since_sweep = 0
         self.max_recent_messages = 5
-        self.processed_messages = set()  # Track processed message IDs
-        self.last_response_time = {}  # phone -> timestamp
+        self.processed_messages: "OrderedDict[str, None]" = OrderedDict()  # Processed message IDs, oldest first
+        self.last_response_time = {}  # phone -> monotonic timestamp
         self.response_cooldown = 5  # seconds between responses to same phone
         self.emergency_stop = False  # Emergency stop flag to prevent flooding
         
         # Background tasks will be started when the event loop is running
         self._background_task = None
+        
+        # Webhooks are acknowledged once queued; workers do the actual handling
+        # Webhooks are sharded by sender, so one phone's messages are always handled in arrival order
+        self._queues: List[asyncio.Queue] = []  # One per worker
+        self._workers: List[asyncio.Task] = []
+        self._accepting = True  # Cleared on shutdown so new webhooks are refused while the queue drains
+        self.dropped_messages = 0
     
     def _load_sent_emails(self):
         """Load sent emails tracking from file"""
         try:
-            import json
-            import os
-            
-            sent_emails_file = "data/sent_emails.json"
-            if os.path.exists(sent_emails_file):
-                with open(sent_emails_file, 'r') as f:
-                    self.sent_emails = json.load(f)
-                logger.info(f"Loaded {len(self.sent_emails)} tracked emails")
+            if os.path.exists(SENT_EMAILS_FILE):
+                with open(SENT_EMAILS_FILE, 'rb') as f:
+                    raw = orjson.loads(f.read())
+                
+                # Drop threads too old to still get replies, then cap the rest
+                now = time.time()
+                cutoff = now - SENT_EMAILS_MAX_AGE
+                self.sent_emails = OrderedDict()
+                for thread_id, info in raw.items():
+                    sent_at = self._sent_wall_time(info)
+                    if sent_at is None:
+                        # Undatable entry (e.g. an old event-loop timestamp): age it from now
+                        info["sent_time_wall"] = sent_at = now
+                    if sent_at > cutoff:
+                        self.sent_emails[thread_id] = info
+                while len(self.sent_emails) > MAX_SENT_EMAILS:
+                    self.sent_emails.popitem(last=False)
+                logger.info(f"Loaded {len(self.sent_emails)} tracked emails ({len(raw) - len(self.sent_emails)} expired)")
             else:
                 logger.info("No sent emails file found, starting fresh")
         except Exception as e:
             logger.error(f"Error loading sent emails: {str(e)}")
-            self.sent_emails = {}
+            self.sent_emails = OrderedDict()
     
-    def _save_sent_emails(self):
-        """Save sent emails tracking to file"""
+    @staticmethod
+    def _sent_wall_time(info: Dict[str, Any]) -> Optional[float]:
+        """Get the epoch time an email was sent, falling back to its ISO sent_time (None if unknown)"""
+        if "sent_time_wall" in info:
+            return info["sent_time_wall"]
         try:
-            import json
-            import os
-            
-            # Create data directory if it doesn't exist
-            os.makedirs("data", exist_ok=True)
-            
-            sent_emails_file = "data/sent_emails.json"
-            with open(sent_emails_file, 'w') as f:
-                json.dump(self.sent_emails, f, indent=2)
-            logger.info(f"Saved {len(self.sent_emails)} tracked emails")
-        except Exception as e:
-            logger.error(f"Error saving sent emails: {str(e)}")
+            return datetime.fromisoformat(info["sent_time"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    async def _save_sent_emails_async(self):
+        """Save sent emails tracking from async code without blocking the event loop"""
+        await self._sent_emails_writer.save_async()
+    
+    def _sent_emails_payload(self) -> bytes:
+        """Serialize the sent emails tracking"""
+        return orjson.dumps(self.sent_emails)
     
     def start_background_tasks(self):
         """Start background tasks when event loop is available"""
@@ -93,22 +184,102 @@ class MessageRouter:
     
     async def start_background_tasks_async(self):
         """Start background tasks when event loop is running"""
+        self._sent_emails_writer.start()
+        
+        if not self._queues:
+            shard_size = max(1, WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS)
+            self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(WEBHOOK_WORKERS)]
+            self._accepting = True
+            self._workers = [asyncio.create_task(self._message_worker(queue)) for queue in self._queues]
+            logger.info(f"Started {WEBHOOK_WORKERS} message workers (queue size {shard_size} each)")
+        
         if self.auto_check_emails and self._background_task is None:
             self._background_task = asyncio.create_task(self._email_monitoring_loop())
             logger.info("Background email monitoring started")
         else:
             logger.info("Background email monitoring disabled (auto_check_emails=False)")
     
+    async def stop_background_tasks(self):
+        """Stop the message workers, email monitoring and sent emails writer"""
+        # Queued webhooks were already acknowledged, so finish them before stopping the workers
+        self._accepting = False
+        if self._queues:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), WEBHOOK_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                remaining = sum(queue.qsize() for queue in self._queues)
+                logger.warning(f"Shutdown drain timed out, {remaining} queued messages not handled")
+        
+        for task in self._workers:
+            task.cancel()
+        if self._background_task:
+            self._background_task.cancel()
+        
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+        self._background_task = None
+        
+        # Stop the sent emails writer, flushing any unsaved change
+        await self._sent_emails_writer.stop()
+    
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Get message queue depth and drop count"""
+        return {
+            "queue_depth": sum(queue.qsize() for queue in self._queues),
+            "queue_size": WEBHOOK_QUEUE_SIZE,
+            "workers": len(self._workers),
+            "dropped_messages": self.dropped_messages
+        }
+    
     async def process_message(self, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Process incoming WhatsApp message
+        Queue an incoming WhatsApp message for the workers and acknowledge it
         
         Args:
             webhook_data: Raw webhook data from UltraMsg
             
         Returns:
-            Processing result
+            Queueing result, with status "overloaded" if the queue is full and the
+            message was not accepted (it is handled inline if the workers aren't running)
         """
+        if not self._queues:
+            return await self._dispatch_message(webhook_data)
+        
+        if not self._accepting:
+            return {"status": "overloaded", "message": "Shutting down"}
+        
+        # Same sender -> same worker, so replies (e.g. HITL "sí"/"no") can't overtake earlier messages
+        queue = self._queues[hash(self._sender_key(webhook_data)) % len(self._queues)]
+        
+        try:
+            queue.put_nowait(webhook_data)
+        except asyncio.QueueFull:
+            self.dropped_messages += 1
+            logger.warning(f"Message queue full, refusing webhook ({self.dropped_messages} refused so far)")
+            return {"status": "overloaded", "message": "Message queue full"}
+        
+        return {"status": "queued"}
+    
+    @staticmethod
+    def _sender_key(webhook_data: Any) -> str:
+        """Get the raw sender of a webhook (same "data"/"from" lookup as parse_incoming_message)"""
+        if not isinstance(webhook_data, dict):
+            return ""
+        message_data = webhook_data.get("data", webhook_data)
+        return (message_data.get("from") if isinstance(message_data, dict) else None) or ""
+    
+    async def _message_worker(self, queue: asyncio.Queue):
+        """Handle one queue shard's webhooks one at a time, in arrival order"""
+        while True:
+            webhook_data = await queue.get()
+            try:
+                await self._dispatch_message(webhook_data)
+            finally:
+                queue.task_done()
+    
+    async def _dispatch_message(self, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse a webhook and route it to the user or external message handler"""
         try:
             # Parse the message
             message_data = self.whatsapp.parse_incoming_message(webhook_data)
@@ -125,6 +296,41 @@ class MessageRouter:
             logger.error(f"Error processing message: {str(e)}")
             return {"status": "error", "message": str(e)}
     
+    def _skip_reason(self, message: str, message_lower: str, message_data: Dict[str, Any],
+                     message_id: Optional[str]) -> Optional[str]:
+        """
+        Check a user message against every skip rule in one pass
+        
+        Args:
+            message: Stripped message body
+            message_lower: Lowercased message body
+            message_data: Parsed message data
+            message_id: Message ID, if the webhook carried one
+        
+        Returns:
+            Why the message should be skipped, or None to handle it
+        """
+        # Empty messages and the assistant's own messages (prevent loops)
+        if len(message) < 2:
+            return "Empty message"
+        if message_data.get("fromMe", False) or message_data.get("is_from_me", False):
+            return "Message from assistant"
+        
+        # Acknowledgments and echoes of the assistant's own responses (prevent loops)
+        if _ACK_RE.search(message_lower):
+            return "Acknowledgment message"
+        if _ASSISTANT_ECHO_RE.search(message_lower):
+            return "Contains assistant response"
+        
+        # Webhook events for message creation/acknowledgment
+        event_type = message_data.get("event_type", "")
+        if event_type in _SKIPPED_EVENT_TYPES:
+            return f"Webhook event: {event_type}"
+        
+        if message_id and message_id in self.processed_messages:
+            return "Already processed"
+        return None
+    
     async def _handle_user_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
         """Handle messages from the user (commands and responses)"""
         # EMERGENCY STOP - If flooding detected, stop all responses
@@ -139,54 +345,27 @@ class MessageRouter:
         # Debug logging
         logger.info(f"Handling user message from: {from_phone}, to: {to_phone}")
         
-        # Skip if message is empty or just acknowledgments
-        if not message or len(message) < 2:
-            logger.info("Skipping empty or very short message")
-            return {"status": "skipped", "message": "Empty message"}
-        
-        # Skip if this is a message from the assistant itself (prevent loops)
-        if message_data.get("fromMe", False) or message_data.get("is_from_me", False):
-            logger.info("Skipping message from assistant itself")
-            return {"status": "skipped", "message": "Message from assistant"}
-        
-        # Skip if this is an acknowledgment message
-        if any(ack_word in message.lower() for ack_word in ["sent", "delivered", "read", "ok", "true"]):
-            logger.info("Skipping acknowledgment message")
-            return {"status": "skipped", "message": "Acknowledgment message"}
-        
-        # Skip if message contains assistant's own responses (prevent loops)
-        assistant_responses = [
-            "¡claro! puedo platicar contigo sobre cualquier tema",
-            "puedo platicar contigo sobre cualquier tema",
-            "lo siento, estoy teniendo problemas para procesar tu mensaje",
-            "entiendo que dijiste",
-            "estoy aquí para ayudarte"
-        ]
-        if any(response in message.lower() for response in assistant_responses):
-            logger.info("Skipping message containing assistant response")
-            return {"status": "skipped", "message": "Contains assistant response"}
-        
-        # Skip if this is a webhook event for message creation/acknowledgment
-        event_type = message_data.get("event_type", "")
-        if event_type in ["message_ack", "message_create", "message_sent"]:
-            logger.info(f"Skipping webhook event: {event_type}")
-            return {"status": "skipped", "message": f"Webhook event: {event_type}"}
-        
-        # Skip if we've already processed this message
+        message_lower = message.lower()
         message_id = message_data.get("message_id") or message_data.get("id")
-        if message_id and message_id in self.processed_messages:
-            logger.info(f"Skipping already processed message: {message_id}")
-            return {"status": "skipped", "message": "Already processed"}
+        
+        skip_reason = self._skip_reason(message, message_lower, message_data, message_id)
+        if skip_reason:
+            logger.info("Skipping message: %s", skip_reason)
+            return {"status": "skipped", "message": skip_reason}
         
         # Mark this message as processed
         if message_id:
-            self.processed_messages.add(message_id)
-            # Keep only last 100 processed message IDs to prevent memory issues
-            if len(self.processed_messages) > 100:
-                self.processed_messages = set(list(self.processed_messages)[-50:])
+            self.processed_messages[message_id] = None
+            # Keep only the most recent IDs, evicting the oldest to prevent memory issues
+            if len(self.processed_messages) > MAX_PROCESSED_MESSAGES:
+                self.processed_messages.popitem(last=False)
         
         # Rate limiting - prevent rapid-fire responses
-        current_time = datetime.now().timestamp()
+        current_time = time.monotonic()
+        self._messages_since_sweep += 1
+        if self._messages_since_sweep >= SENDER_SWEEP_INTERVAL:
+            self._prune_sender_state(current_time)
+        
         if from_phone in self.last_response_time:
             time_since_last = current_time - self.last_response_time[from_phone]
             if time_since_last < self.response_cooldown:
@@ -220,7 +399,7 @@ class MessageRouter:
         pending_actions = self.hitl_manager.get_pending_actions()
         if pending_actions:
             # If there are pending actions, only respond to approval/rejection responses
-            if any(word in message.lower() for word in ["✅", "❌", "sí", "no", "yes", "no", "aprobar", "rechazar"]):
+            if _HITL_REPLY_RE.search(message_lower):
                 # This might be a response to a pending action, let HITL handle it
                 return {"status": "hitl_processing", "message": "Processing HITL response"}
             else:
@@ -239,8 +418,7 @@ class MessageRouter:
             return await self._handle_command(message, response_phone)
         else:
             # Check for calendar keywords in regular messages
-            calendar_keywords = ["schedule", "meeting", "appointment", "agendar", "programar", "reunión", "cita", "calendario"]
-            if any(word in message.lower() for word in calendar_keywords):
+            if _CALENDAR_KEYWORDS_RE.search(message_lower):
                 return await self._handle_calendar_command(message, response_phone)
             else:
                 # It's a regular message from the user - respond with AI
@@ -254,45 +432,14 @@ class MessageRouter:
     
     async def _handle_command(self, command: str, from_phone: str) -> Dict[str, Any]:
         """Handle user commands"""
-        command = command.lower().strip()
+        handler = self._command_table.get(command.lower().strip())
+        if handler:
+            return await handler(from_phone)
         
-        if command == "/status":
-            return await self._send_status_message(from_phone)
-        # elif command == "/emails":
-        #     return await self._check_and_send_emails(from_phone)
-        # elif command == "/allemails":
-        #     return await self._check_and_send_all_emails(from_phone)
-        # elif command == "/calendar":
-        #     return await self._send_calendar_summary(from_phone)
-        elif command == "/help":
-            return await self._send_help_message(from_phone)
-        elif command == "/clear":
-            return await self._clear_conversation(from_phone)
-        elif command == "/personality":
-            return await self._show_personality(from_phone)
-        elif command == "/summary":
-            return await self._show_conversation_summary(from_phone)
-        elif command == "/calendar":
-            return await self._send_calendar_summary(from_phone)
-        elif command == "/events":
-            return await self._list_calendar_events(from_phone)
-        elif command == "/create":
-            return await self._create_calendar_event_prompt(from_phone)
-        elif command == "/delete":
-            return await self._delete_calendar_event_prompt(from_phone)
-        elif command == "/edit":
-            return await self._edit_calendar_event_prompt(from_phone)
-        elif command == "/stop":
-            return await self._emergency_stop_assistant(from_phone)
-        elif command == "/start":
-            return await self._start_assistant(from_phone)
-        # elif command == "/autoemails":
-        #     return await self._toggle_auto_emails(from_phone)
-        else:
-            return await self.whatsapp.send_message(
-                from_phone, 
-                "Unknown command. Use /help for available commands."
-            )
+        return await self.whatsapp.send_message(
+            from_phone, 
+            "Unknown command. Use /help for available commands."
+        )
     
     async def _handle_calendar_command(self, message: str, from_phone: str) -> Dict[str, Any]:
         """Handle calendar-related commands"""
@@ -334,24 +481,6 @@ class MessageRouter:
                     "📅 Google Calendar no está configurado. Por favor, configura las credenciales de Calendar primero."
                 )
             
-            # Parse date and time from message
-            # This is a simplified parser - you might want to use a more sophisticated one
-            import re
-            
-            # Look for date patterns
-            date_patterns = [
-                r'tomorrow',
-                r'today',
-                r'(\d{1,2})/(\d{1,2})',  # MM/DD
-                r'(\d{1,2})-(\d{1,2})',  # MM-DD
-            ]
-            
-            # Look for time patterns
-            time_patterns = [
-                r'(\d{1,2}):(\d{2})\s*(am|pm)?',
-                r'(\d{1,2})\s*(am|pm)',
-            ]
-            
             # For now, check availability for the next 7 days
             start_date = datetime.now()
             end_date = start_date + timedelta(days=7)
@@ -388,14 +517,13 @@ class MessageRouter:
         try:
             # Parse meeting details from message
             # This is simplified - you'd want more sophisticated parsing
-            import re
             
             # Extract title
-            title_match = re.search(r'"([^"]+)"', message)
+            title_match = _QUOTED_TITLE_RE.search(message)
             title = title_match.group(1) if title_match else "Meeting"
             
             # Extract time (simplified)
-            time_match = re.search(r'(\d{1,2}):(\d{2})\s*(am|pm)?', message)
+            time_match = _TIME_RE.search(message)
             if time_match:
                 hour = int(time_match.group(1))
                 minute = int(time_match.group(2))
@@ -511,11 +639,8 @@ class MessageRouter:
     async def _handle_send_email_command(self, message: str, from_phone: str) -> Dict[str, Any]:
         """Handle send email command"""
         try:
-            import re
-            
             # Extract email address
-            email_pattern = r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
-            email_match = re.search(email_pattern, message)
+            email_match = _EMAIL_RE.search(message)
             
             if not email_match:
                 return await self.whatsapp.send_message(
@@ -542,10 +667,14 @@ class MessageRouter:
                     self.sent_emails[thread_id] = {
                         "recipient": recipient_email,
                         "subject": email_content["subject"],
-                        "sent_time": asyncio.get_event_loop().time(),
+                        "sent_time": datetime.now().isoformat(),  # Wall clock: persisted across restarts
+                        "sent_time_wall": time.time(),
                         "original_request": message
                     }
-                    self._save_sent_emails()  # Save to file
+                    self.sent_emails.move_to_end(thread_id)
+                    while len(self.sent_emails) > MAX_SENT_EMAILS:
+                        self.sent_emails.popitem(last=False)
+                    await self._save_sent_emails_async()  # Save to file
                     logger.info(f"Tracking sent email thread: {thread_id} to {recipient_email}")
                 
                 return await self.whatsapp.send_message(
@@ -568,12 +697,9 @@ class MessageRouter:
     async def _generate_email_content(self, message: str, recipient: str) -> Dict[str, str]:
         """Generate email content using AI"""
         try:
-            import re
-            
             # Extract the actual request content, removing the instruction part
             # Look for patterns like "preguntando si está disponible para una reunión mañana a las 9 a.m."
-            meeting_pattern = r'preguntando si está disponible para una reunión (.+?)(?:\.|$)'
-            meeting_match = re.search(meeting_pattern, message.lower())
+            meeting_match = _MEETING_REQUEST_RE.search(message.lower())
             
             if meeting_match:
                 meeting_details = meeting_match.group(1)
@@ -592,20 +718,8 @@ Saludos"""
             else:
                 # For other types of requests, extract the actual content
                 # Remove instruction words and extract the core message
-                content = message
-                # Remove common instruction patterns
-                instruction_patterns = [
-                    r'envíame un correo a [^ ]+ preguntando',
-                    r'send me an email to [^ ]+ asking',
-                    r'envía un correo a [^ ]+ preguntando',
-                    r'envíame un correo a [^ ]+ diciendo',
-                    r'send an email to [^ ]+ saying'
-                ]
-                
-                for pattern in instruction_patterns:
-                    content = re.sub(pattern, '', content, flags=re.IGNORECASE)
-                
-                content = content.strip()
+                # Remove common instruction patterns in one pass
+                content = _EMAIL_INSTRUCTION_RE.sub('', message).strip()
                 
                 subject = "Hola"
                 body = f"""Hola {recipient.split('@')[0]},
@@ -1258,8 +1372,21 @@ También puedes decir: "agendar reunión", "programar cita", "ver calendario"
         
         logger.info("Email monitoring loop stopped (auto-checking disabled)")
     
+    def _prune_sender_state(self, now: float):
+        """Drop rate-limit and loop-detection state for phones inactive longer than SENDER_STATE_TTL"""
+        self._messages_since_sweep = 0
+        cutoff = now - SENDER_STATE_TTL
+        
+        self.last_response_time = {phone: t for phone, t in self.last_response_time.items() if t > cutoff}
+        
+        stale_phones = [phone for phone, t in self._recent_message_times.items() if t <= cutoff]
+        for phone in stale_phones:
+            del self._recent_message_times[phone]
+            self.recent_messages.pop(phone, None)
+    
     def _is_duplicate_message(self, phone: str, message: str) -> bool:
         """Check if this is a duplicate message to prevent loops"""
+        self._recent_message_times[phone] = time.monotonic()
         if phone not in self.recent_messages:
             self.recent_messages[phone] = []
         
@@ -4,9 +4,11 @@ Handles checking availability, creating events, and managing calendar data
 """
 
 import os
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 import json
 
 try:
@@ -15,13 +17,19 @@ try:
     from google_auth_oauthlib.flow import InstalledAppFlow
     from googleapiclient.discovery import build
     from googleapiclient.errors import HttpError
+    import httplib2
+    import google_auth_httplib2
     CALENDAR_AVAILABLE = True
 except ImportError:
     CALENDAR_AVAILABLE = False
     logging.warning("Google Calendar API libraries not installed. Please install google-api-python-client and google-auth-oauthlib")
 
+from src.integrations.google_auth import load_or_refresh_credentials
+
 logger = logging.getLogger(__name__)
 
+MEXICO_TZ = timezone(timedelta(hours=-6))  # Event times are compared as naive Mexico City (UTC-6) datetimes
+
 class CalendarIntegration:
     def __init__(self):
         self.service = None
@@ -32,6 +40,7 @@ class CalendarIntegration:
             'https://www.googleapis.com/auth/calendar.readonly'
         ]
         self.calendar_id = 'primary'  # Use primary calendar by default
+        self._thread_local = threading.local()  # Per-thread HTTP transport (httplib2 is not thread-safe)
         
         if CALENDAR_AVAILABLE:
             self._authenticate()
@@ -113,30 +122,16 @@ class CalendarIntegration:
                 token_file = os.getenv('CALENDAR_TOKEN_FILE', './credentials/calendar_token.json')
                 credentials_file = os.getenv('CALENDAR_CREDENTIALS_FILE', './credentials/calendar_credentials.json')
                 
-                # Load existing credentials
-                if os.path.exists(token_file):
-                    creds = Credentials.from_authorized_user_file(token_file, self.scopes)
-                
-                # If there are no valid credentials, get new ones
-                if not creds or not creds.valid:
-                    if creds and creds.expired and creds.refresh_token:
-                        creds.refresh(Request())
-                    else:
-                        if os.path.exists(credentials_file):
-                            flow = InstalledAppFlow.from_client_secrets_file(
-                                credentials_file, self.scopes)
-                            creds = flow.run_local_server(port=0)
-                        else:
-                            logger.error(f"Calendar credentials file not found: {credentials_file}")
-                            return
-                    
-                    # Save credentials for next run
-                    with open(token_file, 'w') as token:
-                        token.write(creds.to_json())
+                # Load, refresh or re-authorize (refreshes only when close to expiry)
+                creds = load_or_refresh_credentials(token_file, credentials_file, self.scopes)
+                if creds is None:
+                    logger.error(f"Calendar credentials file not found: {credentials_file}")
+                    return
             
             if creds and creds.valid:
                 self.credentials = creds
-                self.service = build('calendar', 'v3', credentials=creds)
+                # Use the discovery document bundled with google-api-python-client (no network fetch)
+                self.service = build('calendar', 'v3', credentials=creds, static_discovery=True, cache_discovery=False)
                 logger.info("Google Calendar API authenticated successfully")
                 
                 # Test the service with a simple API call
@@ -166,6 +161,14 @@ class CalendarIntegration:
             logger.error(f"Calendar authentication failed: {str(e)}")
             self.service = None
     
+    def _execute(self, request):
+        """Execute an API request on this thread's own authorized HTTP transport"""
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._thread_local.http = http
+        return request.execute(http=http)
+    
     async def check_availability(self, start_time: datetime, end_time: datetime) -> Dict[str, Any]:
         """
         Check if the calendar is available for a specific time range
@@ -177,79 +180,99 @@ class CalendarIntegration:
         Returns:
             Availability information
         """
+        return (await self.check_availability_many([(start_time, end_time)]))[0]
+    
+    async def check_availability_many(self, time_ranges: List[Tuple[datetime, datetime]]) -> List[Dict[str, Any]]:
+        """
+        Check several time ranges with a single calendar query
+        
+        Args:
+            time_ranges: (start, end) pairs to check
+        
+        Returns:
+            Availability information for each range, in input order
+        """
         if not self.service:
-            return {"available": False, "error": "Calendar service not available"}
+            return [{"available": False, "error": "Calendar service not available"} for _ in time_ranges]
+        
+        if not time_ranges:
+            return []
         
         try:
-            # Format times for API
-            time_min = start_time.isoformat() + 'Z'
-            time_max = end_time.isoformat() + 'Z'
+            # Format times for API: one window spanning every range
+            time_min = min(start for start, _ in time_ranges).isoformat() + 'Z'
+            time_max = max(end for _, end in time_ranges).isoformat() + 'Z'
             
-            # Query calendar for events in the time range
-            events_result = self.service.events().list(
+            # Query calendar for events in the window (in a worker thread so concurrent checks overlap)
+            events_request = self.service.events().list(
                 calendarId=self.calendar_id,
                 timeMin=time_min,
                 timeMax=time_max,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            )
+            events_result = await asyncio.to_thread(self._execute, events_request)
             
-            events = events_result.get('items', [])
+            # Parse each event once, then match conflicts per range locally
+            events = [(event, *self._event_bounds(event)) for event in events_result.get('items', [])]
             
-            # Check for conflicts
-            conflicts = []
-            for event in events:
-                event_start = event['start'].get('dateTime', event['start'].get('date'))
-                event_end = event['end'].get('dateTime', event['end'].get('date'))
-                
-                # Parse event times with proper timezone handling for Mexico City (UTC-6)
-                if 'T' in event_start:  # DateTime event
-                    # Handle timezone offset properly
-                    if event_start.endswith('Z'):
-                        event_start_dt = datetime.fromisoformat(event_start.replace('Z', '+00:00'))
-                    else:
-                        event_start_dt = datetime.fromisoformat(event_start)
-                    
-                    if event_end.endswith('Z'):
-                        event_end_dt = datetime.fromisoformat(event_end.replace('Z', '+00:00'))
-                    else:
-                        event_end_dt = datetime.fromisoformat(event_end)
-                    
-                    # Convert to Mexico City timezone (UTC-6) and then to naive datetime
-                    from datetime import timezone, timedelta
-                    mexico_tz = timezone(timedelta(hours=-6))
-                    
-                    if event_start_dt.tzinfo is not None:
-                        # Convert to Mexico City timezone
-                        event_start_dt = event_start_dt.astimezone(mexico_tz).replace(tzinfo=None)
-                    if event_end_dt.tzinfo is not None:
-                        # Convert to Mexico City timezone
-                        event_end_dt = event_end_dt.astimezone(mexico_tz).replace(tzinfo=None)
-                else:  # All-day event
-                    event_start_dt = datetime.fromisoformat(event_start)
-                    event_end_dt = datetime.fromisoformat(event_end) + timedelta(days=1)
-                
+            results = []
+            for start_time, end_time in time_ranges:
                 # Check for overlap
-                if (event_start_dt < end_time and event_end_dt > start_time):
-                    conflicts.append({
+                conflicts = [
+                    {
                         'title': event.get('summary', 'No title'),
-                        'start': event_start,
-                        'end': event_end,
+                        'start': event['start'].get('dateTime', event['start'].get('date')),
+                        'end': event['end'].get('dateTime', event['end'].get('date')),
                         'description': event.get('description', '')
-                    })
-            
-            return {
-                "available": len(conflicts) == 0,
-                "conflicts": conflicts,
-                "time_range": {
-                    "start": start_time.isoformat(),
-                    "end": end_time.isoformat()
-                }
-            }
+                    }
+                    for event, event_start_dt, event_end_dt in events
+                    if event_start_dt < end_time and event_end_dt > start_time
+                ]
+                results.append({
+                    "available": len(conflicts) == 0,
+                    "conflicts": conflicts,
+                    "time_range": {
+                        "start": start_time.isoformat(),
+                        "end": end_time.isoformat()
+                    }
+                })
+            
+            return results
             
         except HttpError as e:
             logger.error(f"Error checking availability: {str(e)}")
-            return {"available": False, "error": str(e)}
+            return [{"available": False, "error": str(e)} for _ in time_ranges]
+    
+    @staticmethod
+    def _event_bounds(event: Dict[str, Any]) -> Tuple[datetime, datetime]:
+        """Parse an event's start and end into naive Mexico City datetimes"""
+        event_start = event['start'].get('dateTime', event['start'].get('date'))
+        event_end = event['end'].get('dateTime', event['end'].get('date'))
+        
+        # Parse event times with proper timezone handling for Mexico City (UTC-6)
+        if 'T' in event_start:  # DateTime event
+            # Handle timezone offset properly
+            if event_start.endswith('Z'):
+                event_start_dt = datetime.fromisoformat(event_start.replace('Z', '+00:00'))
+            else:
+                event_start_dt = datetime.fromisoformat(event_start)
+            
+            if event_end.endswith('Z'):
+                event_end_dt = datetime.fromisoformat(event_end.replace('Z', '+00:00'))
+            else:
+                event_end_dt = datetime.fromisoformat(event_end)
+            
+            # Convert to Mexico City timezone (UTC-6) and then to naive datetime
+            if event_start_dt.tzinfo is not None:
+                event_start_dt = event_start_dt.astimezone(MEXICO_TZ).replace(tzinfo=None)
+            if event_end_dt.tzinfo is not None:
+                event_end_dt = event_end_dt.astimezone(MEXICO_TZ).replace(tzinfo=None)
+        else:  # All-day event
+            event_start_dt = datetime.fromisoformat(event_start)
+            event_end_dt = datetime.fromisoformat(event_end) + timedelta(days=1)
+        
+        return event_start_dt, event_end_dt
     
     async def create_event(self, title: str, start_time: datetime, end_time: datetime, 
                           description: str = "", attendees: List[str] = None, 
@@ -21,6 +21,8 @@ except ImportError:
     GMAIL_AVAILABLE = False
     logging.warning("Gmail API libraries not installed. Please install google-api-python-client and google-auth-oauthlib")
 
+from src.integrations.google_auth import load_or_refresh_credentials
+
 logger = logging.getLogger(__name__)
 
 class GmailIntegration:
@@ -80,30 +82,16 @@ class GmailIntegration:
                 token_file = os.getenv('GMAIL_TOKEN_FILE', './credentials/gmail_token.json')
                 credentials_file = os.getenv('GMAIL_CREDENTIALS_FILE', './credentials/gmail_credentials.json')
                 
-                # Load existing credentials
-                if os.path.exists(token_file):
-                    creds = Credentials.from_authorized_user_file(token_file, self.scopes)
-                
-                # If there are no valid credentials, get new ones
-                if not creds or not creds.valid:
-                    if creds and creds.expired and creds.refresh_token:
-                        creds.refresh(Request())
-                    else:
-                        if os.path.exists(credentials_file):
-                            flow = InstalledAppFlow.from_client_secrets_file(
-                                credentials_file, self.scopes)
-                            creds = flow.run_local_server(port=0)
-                        else:
-                            logger.error(f"Gmail credentials file not found: {credentials_file}")
-                            return
-                    
-                    # Save credentials for next run
-                    with open(token_file, 'w') as token:
-                        token.write(creds.to_json())
+                # Load, refresh or re-authorize (refreshes only when close to expiry)
+                creds = load_or_refresh_credentials(token_file, credentials_file, self.scopes)
+                if creds is None:
+                    logger.error(f"Gmail credentials file not found: {credentials_file}")
+                    return
             
             if creds and creds.valid:
                 self.credentials = creds
-                self.service = build('gmail', 'v1', credentials=creds)
+                # Use the discovery document bundled with google-api-python-client (no network fetch)
+                self.service = build('gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False)
                 logger.info("Gmail API authenticated successfully")
             else:
                 logger.error("Gmail authentication failed: Invalid credentials")
@@ -0,0 +1,119 @@
+"""
+Shared Google OAuth helpers
+Loads, refreshes and caches credentials for the Gmail and Calendar integrations
+"""
+
+import os
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+
+from src.persistence import atomic_write_json
+
+try:
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    GOOGLE_AUTH_AVAILABLE = True
+except ImportError:
+    GOOGLE_AUTH_AVAILABLE = False
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens this long before they actually expire
+REFRESH_SKEW = timedelta(minutes=5)
+
+# (token_file, scopes) -> (token file mtime, Credentials), reused across integrations in this process
+_credentials_cache: Dict[Tuple[str, Tuple[str, ...]], Tuple[float, Any]] = {}
+
+def needs_refresh(creds) -> bool:
+    """Check if credentials are missing a token or expire within REFRESH_SKEW"""
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now <= REFRESH_SKEW
+
+def _token_mtime(token_file: str) -> Optional[float]:
+    """Get the token file's mtime, or None if it doesn't exist"""
+    try:
+        return os.stat(token_file).st_mtime
+    except FileNotFoundError:
+        return None
+
+@contextmanager
+def _token_lock(token_file: str):
+    """Hold an exclusive inter-process lock on token_file for the duration of the block"""
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    
+    lock_dir = os.path.dirname(token_file)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(token_file + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_or_refresh_credentials(token_file: str, credentials_file: str, scopes: List[str]) -> Optional[Any]:
+    """
+    Load credentials from a token file, refreshing or re-authorizing only when needed
+    
+    Args:
+        token_file: Path to the stored OAuth token
+        credentials_file: Path to the OAuth client secrets (used when no usable token exists)
+        scopes: OAuth scopes to request
+    
+    Returns:
+        Credentials, or None if the credentials file is missing and no token can be used
+    """
+    cache_key = (token_file, tuple(scopes))
+    
+    # Warm path: reuse the cached credentials while they are comfortably unexpired and the
+    # token file hasn't been deleted or rewritten (e.g. revoked and re-authorized elsewhere)
+    cached = _credentials_cache.get(cache_key)
+    if cached is not None:
+        mtime, creds = cached
+        if mtime == _token_mtime(token_file) and not needs_refresh(creds):
+            return creds
+    creds = None
+    
+    # Serialize refreshes across processes sharing this token file
+    with _token_lock(token_file):
+        # Re-read after acquiring the lock so a waiter picks up the winner's fresh token
+        try:
+            creds = Credentials.from_authorized_user_file(token_file, scopes)
+        except FileNotFoundError:
+            pass
+        
+        if creds and not needs_refresh(creds):
+            _credentials_cache[cache_key] = (_token_mtime(token_file), creds)
+            return creds
+        
+        # If there are no valid credentials, get new ones
+        if creds and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            if not os.path.exists(credentials_file):
+                _credentials_cache.pop(cache_key, None)
+                return None
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
+            creds = flow.run_local_server(port=0)
+        
+        # Save credentials for next run
+        atomic_write_json(token_file, creds.to_json().encode())
+        _credentials_cache[cache_key] = (_token_mtime(token_file), creds)
+    
+    return creds
@@ -3,7 +3,7 @@ WhatsApp Integration using UltraMsg API
 Handles sending and receiving WhatsApp messages
 """
 
-import requests
+import httpx
 import logging
 from typing import Dict, Any, Optional
 import os
@@ -12,7 +12,10 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 
 class WhatsAppIntegration:
-    def __init__(self):
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
+        # Shared pooled client (keep-alive) for UltraMsg API calls; a fallback client is ours to close
+        self._owns_http = http is None
+        self.http = http or httpx.AsyncClient(timeout=30.0)
         self.api_url = os.getenv("ULTRAMSG_API_URL", "https://api.ultramsg.com")
         self.instance_id = os.getenv("ULTRAMSG_INSTANCE_ID")
         self.token = os.getenv("ULTRAMSG_TOKEN")
@@ -38,6 +41,11 @@ class WhatsAppIntegration:
         if not all([self.api_url, self.instance_id, self.token, self.my_phone_number]):
             logger.warning("WhatsApp integration not fully configured. Please set environment variables.")
     
+    async def aclose(self):
+        """Close the HTTP client if this integration created it (an injected client is closed by its owner)"""
+        if self._owns_http:
+            await self.http.aclose()
+    
     def get_status(self) -> Dict[str, Any]:
         """Get the status of the WhatsApp integration"""
         return {
@@ -73,7 +81,7 @@ class WhatsAppIntegration:
             logger.info(f"Sending WhatsApp message to URL: {url}")
             logger.info(f"Request data: {data}")
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.http.post(url, headers=headers, json=data)
             response.raise_for_status()
             
             result = response.json()
@@ -85,7 +93,7 @@ class WhatsAppIntegration:
                 "response": result
             }
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error sending WhatsApp message: {str(e)}")
             return {
                 "success": False,
@@ -117,7 +125,7 @@ class WhatsAppIntegration:
                 "caption": caption
             }
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.http.post(url, headers=headers, json=data)
             response.raise_for_status()
             
             result = response.json()
@@ -129,7 +137,7 @@ class WhatsAppIntegration:
                 "response": result
             }
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error sending WhatsApp media message: {str(e)}")
             return {
                 "success": False,
@@ -0,0 +1,91 @@
+"""
+JSON State Persistence
+Crash-safe file writes and a debounced background writer for persisted state
+"""
+
+import os
+import asyncio
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+def atomic_write_json(path: str, payload: bytes):
+    """
+    Atomically replace a JSON file with already-serialized content
+    
+    Args:
+        path: File to replace (its directory is created if missing)
+        payload: Serialized JSON
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    
+    # Write to a temp file and swap it in so a crash never leaves a truncated file
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_file, path)
+
+class DebouncedWriter:
+    """Coalesces bursts of save requests into one atomic write, made off the event loop"""
+    
+    def __init__(self, path: str, serialize: Callable[[], bytes], delay: float):
+        self.path = path
+        self.serialize = serialize
+        self.delay = delay
+        self._dirty: Optional[asyncio.Event] = None  # Set when the state needs saving
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start the background writer (must be called with a running event loop)"""
+        if self._task is None:
+            self._dirty = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background writer, flushing any unsaved change"""
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        
+        if self._dirty.is_set():
+            self._dirty.clear()
+            await self._write_in_thread()
+    
+    def save(self):
+        """Request a save: coalesced when the writer is running, written immediately otherwise"""
+        if self._task is not None:
+            self._dirty.set()
+            return
+        
+        try:
+            atomic_write_json(self.path, self.serialize())
+        except Exception as e:
+            logger.error(f"Error saving {self.path}: {str(e)}")
+    
+    async def save_async(self):
+        """Request a save from async code without blocking the event loop"""
+        if self._task is not None:
+            self._dirty.set()
+            return
+        await self._write_in_thread()
+    
+    async def _run(self):
+        """Write once per burst of changes"""
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.delay)
+            self._dirty.clear()
+            await self._write_in_thread()
+    
+    async def _write_in_thread(self):
+        """Serialize on the event loop for a consistent snapshot, then write the file in a thread"""
+        try:
+            await asyncio.to_thread(atomic_write_json, self.path, self.serialize())
+        except Exception as e:
+            logger.error(f"Error saving {self.path}: {str(e)}")
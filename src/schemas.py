@@ -2,7 +2,7 @@
 Pydantic schemas for request/response validation
 """
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 from enum import Enum
@@ -38,8 +38,7 @@ class WhatsAppWebhookData(BaseModel):
     media: Optional[str] = None
     filename: Optional[str] = None
     
-    class Config:
-        allow_population_by_field_name = True
+    model_config = ConfigDict(populate_by_name=True)
 
 class EmailData(BaseModel):
     """Schema for email data"""